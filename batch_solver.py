@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+"""
+Batch experiment runner: solves every scenario of a corpus with every combination of
+metaheuristic, solver time and seed on a pool of worker processes, and streams one result
+row per run into a CSV (or Parquet) file as soon as the run finishes.
+"""
+import os
+import io
+import csv
+import glob
+import time
+import random
+import argparse
+import ast
+import contextlib
+import itertools
+import traceback
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from solver_heu import run_scenario_with_metaheuristic
+
+
+FIELDS = ['scenario', 'method', 'solver_time', 'seed', 'status', 'total_mission_time', 'n_stops', 'n_dropped',
+          'dropped_locs', 'load_time', 'set_cover_time', 'allocation_time', 'uav_planning_time', 'wall_time', 'error']
+
+
+def scenario_corpus(paths):
+    '''
+    expands the given scenario files, folders, glob patterns and corpus index.csv files (scenarios_generator
+    --count) into a sorted list of scenario files, keeping the .npz of a scenario saved both as .npz and .pkl'''
+    files = []
+    for path in paths:
+        if path.endswith('.csv'):
+            with open(path) as f:
+                files += [os.path.join(os.path.dirname(path), row['file']) for row in csv.DictReader(f)]
+        elif os.path.isdir(path):
+            files += glob.glob(os.path.join(path, '*_scenario_data.pkl')) + glob.glob(os.path.join(path, '*_scenario_data.npz'))
+        else:
+            files += glob.glob(path)
+    scenarios = {}
+    for file in files:
+        stem, extension = os.path.splitext(file)
+        key = stem if extension in ('.pkl', '.npz') else file
+        if key not in scenarios or extension == '.npz':
+            scenarios[key] = file
+    return sorted(scenarios.values())
+
+
+def run_one(scenario_file, method, solver_time, seed, solver_options):
+    '''
+    solves one (scenario, method, solver time, seed) combination in a worker and returns its result row'''
+    random.seed(seed)
+    np.random.seed(seed)
+    options = {'set_cover_workers': 1}     # the runs already fill the cores, unless --option set_cover_workers=... says otherwise
+    options.update(solver_options, random_seed=seed)
+    row = {'scenario': scenario_file, 'method': method, 'solver_time': solver_time, 'seed': seed}
+    start_time = time.time()
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            result = run_scenario_with_metaheuristic(method, os.path.dirname(scenario_file) or '.', False, None, solver_time,
+                                                     solver_options=options, scenario_file=scenario_file)
+    except Exception:
+        row.update(status='error', error=traceback.format_exc(limit=1).strip().splitlines()[-1])
+    else:
+        stage_times = result['stage_times']
+        row.update(status='ok',
+                   total_mission_time=result['total_mission_time'],
+                   n_stops=len(result['stop_locations']),
+                   n_dropped=len(result['dropped_locs']),
+                   dropped_locs=[(float(x), float(y)) for x, y in result['dropped_locs']],
+                   load_time=stage_times['load'],
+                   set_cover_time=stage_times['set_cover'],
+                   allocation_time=stage_times['allocation'],
+                   uav_planning_time=stage_times['uav_planning'])
+    row['wall_time'] = time.time() - start_time
+    return row
+
+
+class ResultWriter():
+    '''
+    appends result rows to a CSV file, or to a Parquet file (needs pyarrow) when the name ends in .parquet'''
+
+    def __init__(self, output):
+        self.parquet = output.endswith('.parquet')
+        if self.parquet:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+            self.pa = pa
+            self.schema = pa.schema([(name, pa.string()) for name in FIELDS])
+            self.writer = pq.ParquetWriter(output, self.schema)
+        else:
+            self.file = open(output, 'w', newline='')
+            self.writer = csv.DictWriter(self.file, fieldnames=FIELDS)
+            self.writer.writeheader()
+
+    def write(self, row):
+        row = {name: row.get(name) for name in FIELDS}
+        if self.parquet:
+            columns = {name: [None if row[name] is None else str(row[name])] for name in FIELDS}
+            self.writer.write_table(self.pa.table(columns, schema=self.schema))
+        else:
+            self.writer.writerow(row)
+            self.file.flush()
+
+    def close(self):
+        if self.parquet:
+            self.writer.close()
+        else:
+            self.file.close()
+
+
+def run_batch(scenarios, methods, solver_times, seeds, output, workers, solver_options = None):
+    '''
+    fans every scenario x method x solver time x seed run out over the worker pool and writes
+    each result row to output as it finishes. Returns the number of runs.'''
+    runs = list(itertools.product(scenarios, methods, solver_times, seeds))
+    writer = ResultWriter(output)
+    done = 0
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = [pool.submit(run_one, *run, solver_options or {}) for run in runs]
+            for future in as_completed(futures):
+                row = future.result()
+                writer.write(row)
+                done += 1
+                print('[{}/{}] {} {} {}s seed {} -> {}'.format(done, len(runs), os.path.basename(row['scenario']), row['method'],
+                                                               row['solver_time'], row['seed'], row.get('total_mission_time', row['status'])))
+    finally:
+        writer.close()
+    return len(runs)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the solver over scenarios x methods x solver times x seeds")
+    parser.add_argument("--scenarios", type=str, nargs='+', default=['scenarios'],
+                        help="Scenario files, folders or glob patterns")
+    parser.add_argument("--methods", type=str, nargs='+', default=['GUIDED_LOCAL_SEARCH'],
+                        help="Metaheuristics. Example: --methods TABU_SEARCH GUIDED_LOCAL_SEARCH")
+    parser.add_argument("--solver_times", type=int, nargs='+', default=[15],
+                        help="Solver times (s) for solving E-VRPTW inside the UAV planner")
+    parser.add_argument("--seeds", type=int, nargs='+', default=[0],
+                        help="Random seeds")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(),
+                        help="Number of worker processes")
+    parser.add_argument("--output", type=str, default='results.csv',
+                        help="Results file (.csv, or .parquet with pyarrow installed)")
+    parser.add_argument("--option", type=str, action='append', default=[],
+                        help="Major_Replan attribute override applied to every run. Example: --option multi_sortie=True")
+    args = parser.parse_args()
+
+    solver_options = {}
+    for option in args.option:
+        key, value = option.split('=', 1)
+        solver_options[key] = ast.literal_eval(value)
+
+    scenarios = scenario_corpus(args.scenarios)
+    run_batch(scenarios, args.methods, args.solver_times, args.seeds, args.output, args.workers, solver_options)
@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+"""
+Stage-level benchmark of the solver pipeline.
+
+Times every stage separately (scenario load, CP_set_cover, Allocation_function, UAV_planner model
+build and search, path_) on the bundled SS / MS / LS scenarios and on seeded synthetic larger
+instances, with fixed seeds and short solver limits. The median of each stage is compared against
+a stored JSON baseline and the stages slower than the baseline are flagged.
+"""
+import os
+import io
+import sys
+import json
+import time
+import pickle
+import random
+import argparse
+import contextlib
+import numpy as np
+
+from solver_heu import build_replan
+from scenarios_generator import generate_scenario
+
+
+BUNDLED = {'SS': 'scenarios/SS_scenario_data.pkl',
+           'MS': 'scenarios/MS_scenario_data.pkl',
+           'LS': 'scenarios/LS_scenario_data.pkl'}
+
+SYNTHETIC = {'XL': {'points_per_branch': 60, 'coord_max': 40, 'type': 'B', 'num_uav_points': 80, 'seed': 1},
+             'XXL': {'points_per_branch': 90, 'coord_max': 50, 'type': 'B', 'num_uav_points': 120, 'seed': 2}}
+
+STAGES = ['load', 'set_cover', 'allocation', 'uav_build', 'uav_search', 'path']
+
+
+def scenario_bytes(case):
+    '''
+    returns the pickled scenario of a bundled or synthetic case'''
+    if case in BUNDLED:
+        with open(BUNDLED[case], 'rb') as f:
+            return f.read()
+    spec = dict(SYNTHETIC[case])
+    rng = random.Random(spec.pop('seed'))
+    return pickle.dumps(generate_scenario(rng=rng, **spec))
+
+
+def time_stages(raw, solver_time, solution_limit, seed):
+    '''
+    runs the pipeline once on a pickled scenario and returns the wall time (s) of each stage'''
+    times = dict.fromkeys(STAGES, 0.0)
+
+    start = time.perf_counter()
+    replan = build_replan(pickle.loads(raw), 'GUIDED_LOCAL_SEARCH')
+    if replan.road_distance_matrix is None:     # not loaded from precomputed artifacts
+        replan.build_road_distance_oracle()
+    times['load'] = time.perf_counter() - start
+
+    replan.solver_time = solver_time
+    replan.solution_limit = solution_limit
+    replan.random_seed = seed
+    Targets, Locations, starting = replan.Targets, replan.Locations, replan.starting
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        start = time.perf_counter()
+        stops = replan.CP_set_cover(Targets, Locations, starting)
+        times['set_cover'] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        Allocation = replan.Allocation_function(Targets, Locations, starting)
+        times['allocation'] = time.perf_counter() - start
+
+        for (UGV_start_stop, UGV_end_stop), UAV_points in Allocation.items():
+            if not UAV_points:
+                continue
+            UGV_end_stop_time = int(replan.cu_dis1(UGV_start_stop, UGV_end_stop)/replan.ugv_speed)
+            try:
+                replan.UAV_planner(UGV_start_stop, UAV_points, UGV_end_stop, UGV_end_stop_time, warm_start=False)
+            except RuntimeError:    # infeasible subproblem, the search still ran to its limit
+                pass
+            times['uav_build'] += replan.last_build_time
+            times['uav_search'] += replan.last_search_time
+
+    start = time.perf_counter()
+    for a in stops:
+        for b in stops:
+            replan.path_(a, b)
+    times['path'] = time.perf_counter() - start
+    return times
+
+
+def run_benchmark(cases, repeats, solver_time, solution_limit, seed):
+    '''
+    returns {case: {stage: median wall time (s)}}'''
+    results = {}
+    for case in cases:
+        random.seed(seed)
+        np.random.seed(seed)
+        raw = scenario_bytes(case)
+        runs = [time_stages(raw, solver_time, solution_limit, seed) for _ in range(repeats)]
+        results[case] = {stage: float(np.median([run[stage] for run in runs])) for stage in STAGES}
+        print('{:>4} '.format(case) + '  '.join('{} {:.4f}s'.format(stage, results[case][stage]) for stage in STAGES))
+    return results
+
+
+def compare(results, baseline, tolerance, min_delta):
+    '''
+    returns the (case, stage, baseline, current) entries slower than baseline*(1+tolerance) by more than min_delta s'''
+    regressions = []
+    for case, stages in results.items():
+        for stage, current in stages.items():
+            reference = baseline.get(case, {}).get(stage)
+            if reference is None:
+                continue
+            if current > reference*(1 + tolerance) and current - reference > min_delta:
+                regressions.append((case, stage, reference, current))
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark each stage of the solver pipeline")
+    parser.add_argument("--cases", type=str, nargs='+', default=list(BUNDLED) + list(SYNTHETIC),
+                        choices=list(BUNDLED) + list(SYNTHETIC), help="Scenarios to benchmark")
+    parser.add_argument("--repeats", type=int, default=3,
+                        help="Runs per scenario; the median is reported")
+    parser.add_argument("--solver_time", type=int, default=2,
+                        help="Time limit (s) of each UAV planner search")
+    parser.add_argument("--solution_limit", type=int, default=50,
+                        help="Solution limit of each UAV planner search (fixed amount of search work)")
+    parser.add_argument("--seed", type=int, default=0,
+                        help="Random seed")
+    parser.add_argument("--baseline", type=str, default='benchmark_baseline.json',
+                        help="JSON baseline to compare against")
+    parser.add_argument(
+        "--save_baseline",
+        type=lambda x: (str(x).lower() == 'true'),
+        default=False,
+        help="Store the results as the new baseline instead of comparing"
+    )
+    parser.add_argument("--tolerance", type=float, default=0.25,
+                        help="Relative slowdown allowed before a stage is flagged")
+    parser.add_argument("--min_delta", type=float, default=0.005,
+                        help="Absolute slowdown (s) below which a stage is never flagged")
+    args = parser.parse_args()
+
+    results = run_benchmark(args.cases, args.repeats, args.solver_time, args.solution_limit, args.seed)
+
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(results, f, indent=2)
+        print('Baseline saved to {}'.format(args.baseline))
+    elif os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.tolerance, args.min_delta)
+        for case, stage, reference, current in regressions:
+            print('SLOWER: {} {} {:.4f}s -> {:.4f}s (+{:.0f}%)'.format(case, stage, reference, current, 100*(current/reference - 1)))
+        if regressions:
+            sys.exit(1)
+        print('No stage slower than the baseline')
+    else:
+        print('No baseline at {}; run with --save_baseline True to create one'.format(args.baseline))
@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+"""
+Scaling study: runtime and peak memory of each pipeline stage vs. the number of UGV / UAV points.
+
+Generates seeded Type B instances over a sweep of sizes, runs the pipeline on each one with fixed
+solver budgets in a fresh process (so that the peak memory of a size is not hidden by the previous
+ones, and a size that does not finish within --timeout can be stopped), and fits the empirical
+complexity exponent b of time ~ n^b for every stage.
+"""
+import csv
+import json
+import math
+import time
+import pickle
+import random
+import resource
+import argparse
+import tracemalloc
+import multiprocessing
+import numpy as np
+from queue import Empty
+
+from benchmark_stages import STAGES, time_stages
+from scenarios_generator import generate_scenario
+
+
+def instance(n_points, uav_ratio, seed):
+    '''
+    pickled Type B scenario with about n_points road points (three branches) and uav_ratio*n_points
+    UAV points; the theatre grows with the number of points to keep a similar point density'''
+    points_per_branch = max(2, n_points // 3)
+    coord_max = max(10, int(round(10*math.sqrt(n_points/36))))
+    num_uav_points = max(1, min(3*points_per_branch, int(uav_ratio*n_points)))
+    rng = random.Random(seed)
+    return pickle.dumps(generate_scenario(points_per_branch, coord_max, 'B', num_uav_points, rng))
+
+
+def measure(n_points, uav_ratio, seed, solver_time, solution_limit, python_memory, queue):
+    '''
+    worker: times the stages of one size with tracemalloc off and reports them with the peak resident memory;
+    with python_memory, runs the pipeline a second time under tracemalloc (which slows the python stages
+    down several times, so its timings are discarded) and reports the peak python allocation'''
+    raw = instance(n_points, uav_ratio, seed)
+    times = time_stages(raw, solver_time, solution_limit, seed)
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss*1024   # kB on linux
+    queue.put(dict(times, peak_rss_mb=peak_rss/2**20))
+    if python_memory:
+        tracemalloc.start()
+        time_stages(raw, solver_time, solution_limit, seed)
+        _, peak_python = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        queue.put({'peak_python_mb': peak_python/2**20})
+
+
+def receive(queue, worker, deadline, poll = 0.5):
+    '''
+    next result of the worker; raises Empty once the deadline passes, or within poll s of the worker
+    exiting without sending it (exception, segfault, OOM kill)'''
+    while True:
+        try:
+            return queue.get(timeout=poll)
+        except Empty:
+            if not worker.is_alive():
+                return queue.get(timeout=poll)    # a result put just before the exit may still be in the pipe
+            if time.time() >= deadline:
+                raise
+
+
+def run_size(n_points, uav_ratio, seed, solver_time, solution_limit, python_memory, timeout):
+    '''
+    runs one size in a fresh process; returns its row, with status 'timeout' when the timing pass does not
+    finish in time and 'error' as soon as the worker dies without a result (the peak python allocation is
+    left empty when only the tracemalloc pass does not finish)'''
+    row = {'n_points': n_points, 'n_uav_points': int(uav_ratio*n_points)}
+    queue = multiprocessing.Queue()
+    worker = multiprocessing.Process(target=measure, args=(n_points, uav_ratio, seed, solver_time, solution_limit,
+                                                          python_memory, queue))
+    start = time.time()
+    worker.start()
+    try:
+        row.update(receive(queue, worker, start + timeout), status='ok')
+        if python_memory:
+            row.update(receive(queue, worker, start + timeout))
+    except Exception:
+        if 'status' not in row:
+            row['status'] = 'timeout' if worker.is_alive() else 'error'
+    worker.join(1)
+    if worker.is_alive():
+        worker.terminate()
+        worker.join()
+    row['wall_time'] = time.time() - start
+    return row
+
+
+def complexity(rows):
+    '''
+    least squares fit of log(time) = a + b*log(n) for every stage; returns {stage: b}'''
+    exponents = {}
+    for stage in STAGES:
+        points = [(row['n_points'], row[stage]) for row in rows if row['status'] == 'ok' and row[stage] > 0]
+        if len(points) < 2:
+            continue
+        n, t = np.array(points, dtype=float).T
+        exponents[stage] = float(np.polyfit(np.log(n), np.log(t), 1)[0])
+    return exponents
+
+
+def plot_curves(rows, file_name):
+    '''
+    log-log runtime curves of every stage, rendered to a file'''
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    fig, ax = plt.subplots()
+    ok = [row for row in rows if row['status'] == 'ok']
+    for stage in STAGES:
+        ax.loglog([row['n_points'] for row in ok], [max(row[stage], 1e-6) for row in ok], marker='o', label=stage)
+    ax.set_xlabel('Number of road points')
+    ax.set_ylabel('Wall time (s)')
+    ax.legend()
+    fig.savefig(file_name)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Runtime and memory of each stage vs. number of points")
+    parser.add_argument("--sizes", type=int, nargs='+', default=[50, 100, 200, 500, 1000, 2000],
+                        help="Numbers of road (UGV) points")
+    parser.add_argument("--uav_ratio", type=float, default=0.4,
+                        help="UAV points per road point")
+    parser.add_argument("--seed", type=int, default=0,
+                        help="Random seed")
+    parser.add_argument("--solver_time", type=int, default=2,
+                        help="Time limit (s) of each UAV planner search")
+    parser.add_argument("--solution_limit", type=int, default=50,
+                        help="Solution limit of each UAV planner search")
+    parser.add_argument("--timeout", type=float, default=600,
+                        help="Seconds after which a size is stopped and reported as timeout")
+    parser.add_argument(
+        "--python_memory",
+        type=lambda x: (str(x).lower() == 'true'),
+        default=False,
+        help="Also measure the peak python allocation with tracemalloc, in a second untimed pass of every size"
+    )
+    parser.add_argument("--output", type=str, default='scaling_results.csv',
+                        help="CSV file with one row per size")
+    parser.add_argument("--plot", type=str, default=None,
+                        help="Optional image file for the log-log runtime curves")
+    args = parser.parse_args()
+
+    rows = []
+    for n_points in args.sizes:
+        row = run_size(n_points, args.uav_ratio, args.seed, args.solver_time, args.solution_limit, args.python_memory, args.timeout)
+        rows.append(row)
+        if row['status'] == 'ok':
+            print('n = {:>5}  '.format(n_points) + '  '.join('{} {:.3f}s'.format(stage, row[stage]) for stage in STAGES)
+                  + '  peak rss {:.0f} MB'.format(row['peak_rss_mb']))
+        else:
+            print('n = {:>5}  {} after {:.0f}s'.format(n_points, row['status'], row['wall_time']))
+
+    fields = ['n_points', 'n_uav_points', 'status'] + STAGES + ['peak_python_mb', 'peak_rss_mb', 'wall_time']
+    with open(args.output, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=fields)
+        writer.writeheader()
+        for row in rows:
+            writer.writerow({name: row.get(name) for name in fields})
+
+    exponents = complexity(rows)
+    print('\nEmpirical complexity (time ~ n^b):')
+    print(json.dumps({stage: round(b, 2) for stage, b in exponents.items()}, indent=2))
+
+    if args.plot:
+        plot_curves(rows, args.plot)
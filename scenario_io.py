@@ -0,0 +1,244 @@
+# -*- coding: utf-8 -*-
+"""
+Reading and writing of scenario files.
+
+A scenario is stored either as the original pickle (lists of coordinates and a networkx road graph)
+or as a compact .npz archive of NumPy arrays:
+
+    UGV_X, UGV_Y, UAV_X, UAV_Y      coordinates (miles)
+    nodes                           (n, 2) coordinates of the road graph nodes, in graph order
+    indptr, indices, weights        road graph adjacency in CSR form (edge lengths in ft)
+
+load_scenario returns the arrays of an .npz archive (or of one scenario of a corpus shard) memory-mapped:
+nothing is read until an array is accessed, and then only the pages it spans. The road network stays in
+CSR form (scenario_csr); the networkx graph is only built, and networkx imported, when UGV_graph is
+accessed.
+
+Both formats can also carry the distance artifacts of compute_artifacts (road all-pairs distances and
+predecessors, UGV stop to mission point euclidean distances), which the solver loads instead of
+recomputing them.
+"""
+import pickle
+import struct
+import zipfile
+from heapq import heappush, heappop
+from collections.abc import Mapping
+import numpy as np
+
+
+FORMAT_VERSION = 1
+
+# arrays of every scenario of a corpus shard (see save_shard) #
+SHARD_ARRAYS = ['UGV_X', 'UGV_Y', 'UAV_X', 'UAV_Y', 'nodes', 'indptr', 'indices', 'weights']
+
+CSR_ARRAYS = ['nodes', 'indptr', 'indices', 'weights']
+
+
+def graph_to_csr(G):
+    '''
+    returns (nodes, indptr, indices, weights) of a road graph whose nodes are coordinate tuples'''
+    nodes = list(G.nodes())
+    index = {nodes[k]: k for k in range(len(nodes))}
+    indptr, indices, weights = [0], [], []
+    for node in nodes:
+        for neighbour, attributes in G.adj[node].items():
+            indices.append(index[neighbour])
+            weights.append(attributes['weight'])
+        indptr.append(len(indices))
+    return (np.array(nodes, dtype=float).reshape(-1, 2), np.array(indptr, dtype=np.int64),
+            np.array(indices, dtype=np.int64), np.array(weights, dtype=float))
+
+
+def csr_to_graph(nodes, indptr, indices, weights):
+    '''
+    rebuilds the networkx road graph (same node and adjacency order) from its CSR arrays'''
+    import networkx as nx
+    keys = [tuple(point) for point in nodes]
+    rows = np.repeat(np.arange(len(keys)), np.diff(indptr))
+    G = nx.Graph()
+    G.add_nodes_from(keys)
+    G.add_weighted_edges_from((keys[u], keys[v], w) for u, v, w in zip(rows, indices, weights))
+    return G
+
+
+def save_scenario(data, file_path):
+    '''
+    writes the scenario data dict to file_path, as an .npz archive when the name ends in .npz and as a pickle otherwise'''
+    if not file_path.endswith('.npz'):
+        if isinstance(data, Scenario):     # pickles hold the networkx graph instead of the CSR arrays
+            data = {key: data[key] if key == 'UGV_graph' else np.array(data[key]) for key in data if key not in CSR_ARRAYS}
+        with open(file_path, 'wb') as f:
+            pickle.dump(data, f)
+        return
+    nodes, indptr, indices, weights = scenario_csr(data)
+    arrays = {key: np.asarray(data[key]) for key in data if key != 'UGV_graph' and key not in CSR_ARRAYS}
+    np.savez(file_path, version=FORMAT_VERSION, nodes=nodes, indptr=indptr, indices=indices, weights=weights, **arrays)
+
+
+def save_shard(scenarios, file_path):
+    '''
+    writes the scenarios of a corpus shard (array dicts of scenarios_generator.generate_scenario_arrays)
+    into one .npz file: every array of SHARD_ARRAYS concatenated over the scenarios, with <name>_ptr
+    offsets delimiting each scenario'''
+    arrays = {'version': FORMAT_VERSION, 'count': len(scenarios)}
+    for key in SHARD_ARRAYS:
+        parts = [np.asarray(scenario[key]) for scenario in scenarios]
+        arrays[key] = np.concatenate(parts)
+        arrays[key + '_ptr'] = np.concatenate(([0], np.cumsum([len(part) for part in parts]))).astype(np.int64)
+    np.savez(file_path, **arrays)
+
+
+def npz_member_offsets(file_path):
+    '''
+    returns {name: offset of the .npy data} of the arrays stored uncompressed in an .npz archive (np.savez),
+    read from the zip directory only'''
+    with zipfile.ZipFile(file_path) as archive:
+        infos = archive.infolist()
+    offsets = {}
+    for info in infos:
+        if info.compress_type != zipfile.ZIP_STORED or not info.filename.endswith('.npy'):
+            raise ValueError('{} is not an uncompressed .npz archive'.format(file_path))
+        offsets[info.filename[:-4]] = info.header_offset
+    return offsets
+
+
+def npz_member(file_path, header_offset):
+    '''
+    memory-maps the array whose zip entry starts at header_offset (see npz_member_offsets); returned as a
+    plain ndarray view of the map, so nothing is read until it is accessed'''
+    with open(file_path, 'rb') as f:
+        f.seek(header_offset + 26)
+        name_length, extra_length = struct.unpack('<HH', f.read(4))
+        f.seek(name_length + extra_length, 1)
+        version = np.lib.format.read_magic(f)
+        if version == (1, 0):
+            shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+        else:
+            shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(f)
+        offset = f.tell()
+    if int(np.prod(shape)) == 0:
+        return np.empty(shape, dtype=dtype)
+    return np.memmap(file_path, dtype=dtype, mode='r', offset=offset, shape=shape,
+                     order='F' if fortran_order else 'C').view(np.ndarray)
+
+
+class Scenario(Mapping):
+    '''
+    read-only scenario data dict of an .npz archive, or of the scenario at position of a corpus shard.
+    Arrays are memory-mapped when first accessed, so only the slices that are used are read from disk;
+    UGV_graph is built from the CSR arrays on first access'''
+
+    def __init__(self, file_path, position=None):
+        self.file_path = file_path
+        self.position = position
+        self.offsets = npz_member_offsets(file_path)
+        if position is None:
+            self.names = [key for key in self.offsets if key != 'version']
+        else:
+            self.names = list(SHARD_ARRAYS)
+        self.names.append('UGV_graph')
+        self.cache = {}
+
+    def __getitem__(self, key):
+        if key not in self.cache:
+            if key not in self.names:
+                raise KeyError(key)
+            if key == 'UGV_graph':
+                self.cache[key] = csr_to_graph(*scenario_csr(self))
+            elif self.position is None:
+                self.cache[key] = npz_member(self.file_path, self.offsets[key])
+            else:
+                ptr = npz_member(self.file_path, self.offsets[key + '_ptr'])
+                self.cache[key] = npz_member(self.file_path, self.offsets[key])[ptr[self.position]:ptr[self.position+1]]
+        return self.cache[key]
+
+    def __contains__(self, key):
+        return key in self.names
+
+    def __iter__(self):
+        return iter(self.names)
+
+    def __len__(self):
+        return len(self.names)
+
+
+def load_scenario(file_path):
+    '''
+    reads a scenario written by save_scenario (or an original pickle), or the scenario at <position> of
+    a corpus shard given as <shard>.npz#<position>. A pickle is returned as its data dict, with the road
+    network as a networkx graph under UGV_graph; an .npz as a lazy Scenario mapping (see scenario_csr)'''
+    if '#' in file_path:
+        shard_path, position = file_path.rsplit('#', 1)
+        return Scenario(shard_path, int(position))
+    if not file_path.endswith('.npz'):
+        with open(file_path, 'rb') as f:
+            return pickle.load(f)
+    return Scenario(file_path)
+
+
+def scenario_csr(data):
+    '''
+    (nodes, indptr, indices, weights) of the road network of a scenario, from its CSR arrays when it has
+    them and from its networkx graph otherwise'''
+    if 'indptr' in data:
+        return tuple(data[key] for key in CSR_ARRAYS)
+    return graph_to_csr(data['UGV_graph'])
+
+
+def euclidean_ft(a, b):
+    '''
+    integer euclidean distances (ft) between the points of a (rows) and of b (columns), given in miles'''
+    a = np.asarray(a, dtype=float).reshape(-1, 2)[:, None, :]
+    b = np.asarray(b, dtype=float).reshape(-1, 2)[None, :, :]
+    return (np.sqrt(np.sum(np.square(a - b), axis=2))*5280).astype(np.int64)
+
+
+def csr_distance_oracle(indptr, indices, weights):
+    '''
+    all-pairs road distances (ft, -1 when unreachable) and shortest path predecessors (-1 at the source)
+    of a CSR road graph, by single-source Dijkstra from every node. Ties are broken as networkx's
+    dijkstra_predecessor_and_distance does (first listed predecessor), so the paths are the same as on
+    the graph rebuilt by csr_to_graph'''
+    indptr, indices, weights = np.asarray(indptr).tolist(), np.asarray(indices).tolist(), np.asarray(weights).tolist()
+    n = len(indptr) - 1
+    distance = np.full((n, n), -1, dtype=np.int64)
+    predecessors = np.full((n, n), -1, dtype=np.int64)
+    for s in range(n):
+        final = [None]*n
+        seen = [None]*n
+        pred = [-1]*n
+        seen[s] = 0
+        fringe = [(0, 0, s)]
+        pushed = 1
+        while fringe:
+            d, _, v = heappop(fringe)
+            if final[v] is not None:
+                continue
+            final[v] = d
+            for k in range(indptr[v], indptr[v+1]):
+                u = indices[k]
+                du = d + weights[k]
+                if final[u] is None and (seen[u] is None or du < seen[u]):
+                    seen[u] = du
+                    pred[u] = v
+                    heappush(fringe, (du, pushed, u))
+                    pushed += 1
+        distance[s] = [-1 if d is None else int(d) for d in final]
+        predecessors[s] = pred
+    return distance, predecessors
+
+
+def compute_artifacts(data):
+    '''
+    returns the distance artifacts of a scenario: road_distance and road_predecessors (see csr_distance_oracle),
+    and coverage_distance between the unique ugv points (coverage_stops) and the unique mission points
+    (coverage_targets) as the solver builds them'''
+    _, indptr, indices, weights = scenario_csr(data)
+    distance, predecessors = csr_distance_oracle(indptr, indices, weights)
+    ugv = [(round(x,2), round(y,2)) for x, y in zip(data['UGV_X'], data['UGV_Y'])]
+    uav = [(round(x,2), round(y,2)) for x, y in zip(data['UAV_X'], data['UAV_Y'])]
+    stops = list(dict.fromkeys(ugv))
+    targets = list(dict.fromkeys(ugv + uav))     # in the order of the solver's point ids
+    return {'road_distance': distance, 'road_predecessors': predecessors,
+            'coverage_stops': np.array(stops, dtype=float), 'coverage_targets': np.array(targets, dtype=float),
+            'coverage_distance': euclidean_ft(stops, targets)}
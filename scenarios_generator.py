@@ -4,13 +4,14 @@ Created on Thu Jul  7 11:06:21 2022
 @author: safwan
 """
 import os
+import csv
 import random
 import numpy as np
-import matplotlib.pyplot as plt
-import pickle
-import networkx as nx
 import argparse
 import math
+from concurrent.futures import ProcessPoolExecutor
+
+from scenario_io import save_scenario, save_shard, compute_artifacts
 
 
 #### Notes ###
@@ -22,54 +23,32 @@ import math
     The UAV points are generated randomly within a specified radius from the UGV points.
     The coordinates of the points are generated randomly within a specified range. 
     The number of points in each branch is determined by the scale of the scenario.
-    The scenario is saved as a pickle file in a specified folder.
+    The scenario is saved as a pickle file, or as a compact .npz archive (see scenario_io), in a specified folder.
 '''
 
-def scenatio_generator(scale, type, plotting = True):
+SCALES = {'SS': {'points_per_branch': 12, 'coord_max': 10, 'num_uav_points': 20},
+          'MS': {'points_per_branch': 20, 'coord_max': 15, 'num_uav_points': 30},
+          'LS': {'points_per_branch': 34, 'coord_max': 24, 'num_uav_points': 40}}
+
+
+def generate_scenario(points_per_branch, coord_max, type, num_uav_points = None, rng = random):
     """
-    Generates a scenario based on the given scale and type.
+    Generates the data of one scenario with three road branches of points_per_branch points and
+    corner coordinates in [1, coord_max]. rng is the random source (e.g. random.Random(seed)).
+    Returns the scenario data dict.
     """
     
 
     # ----- Random point generation -----
 
-    if scale == 'SS':
-        p1 = (random.randint(1, 10), random.randint(1, 10))
-        p2 = (random.randint(1, 10), random.randint(1, 10))
-        p3 = (random.randint(1, 10), random.randint(1, 10))
-        p4 = (random.randint(1, 10), random.randint(1, 10))
-
-        A = np.round(np.linspace(p1, p2, 12), 2)
-        B = np.round(np.linspace(p2, p3, 12), 2)
-        C = np.round(np.linspace(p2, p4, 12), 2)
-        
-        
-
-    if scale == 'MS':
-        p1 = (random.randint(1,15),random.randint(1,15))
-        p2 = (random.randint(1,15),random.randint(1,15))
-        p3 = (random.randint(1,15),random.randint(1,15))
-        p4 = (random.randint(1,15),random.randint(1,15))
-
-
-        A = np.round(np.linspace(p1,p2,20), 2)
-        B = np.round(np.linspace(p2,p3,20), 2)  
-        C = np.round(np.linspace(p2,p4,20), 2)
-
-    
-
+    p1 = (rng.randint(1, coord_max), rng.randint(1, coord_max))
+    p2 = (rng.randint(1, coord_max), rng.randint(1, coord_max))
+    p3 = (rng.randint(1, coord_max), rng.randint(1, coord_max))
+    p4 = (rng.randint(1, coord_max), rng.randint(1, coord_max))
 
-    if scale == 'LS':
-        p1 = (random.randint(1,24),random.randint(1,24))
-        p2 = (random.randint(1,24),random.randint(1,24))
-        p3 = (random.randint(1,24),random.randint(1,24))
-        p4 = (random.randint(1,24),random.randint(1,24))
-
-
-        A = np.round(np.linspace(p1,p2,34),2)
-        B = np.round(np.linspace(p2,p3,34), 2)
-        C = np.round(np.linspace(p2,p4,34), 2)
-        
+    A = np.round(np.linspace(p1, p2, points_per_branch), 2)
+    B = np.round(np.linspace(p2, p3, points_per_branch), 2)
+    C = np.round(np.linspace(p2, p4, points_per_branch), 2)
         
 
 
@@ -92,20 +71,14 @@ def scenatio_generator(scale, type, plotting = True):
     if type == 'B' :
 
         UAV_X, UAV_Y = [], []
-        if scale == 'SS':
-            num_uav_points =  20 # Limit to 10 UAV points
-        elif scale == 'MS':
-            num_uav_points = 30  # Limit to 20 UAV points
-        elif scale == 'LS':
-            num_uav_points = 40  # Limit to 30 UAV points
-
-        selected_indices = random.sample(range(len(X)), num_uav_points)
+
+        selected_indices = rng.sample(range(len(X)), num_uav_points)
         for idx in selected_indices:
             base_x, base_y = X[idx], Y[idx]
 
             # Generate a random offset within a circle of radius ≤ 4 miles (uav's fuel radisus)
-            radius = random.uniform(0.5, 4.0)  # at least 0.5 miles away
-            angle = random.uniform(0, 2 * math.pi)
+            radius = rng.uniform(0.5, 4.0)  # at least 0.5 miles away
+            angle = rng.uniform(0, 2 * math.pi)
 
             offset_x = radius * math.cos(angle)
             offset_y = radius * math.sin(angle)
@@ -120,31 +93,147 @@ def scenatio_generator(scale, type, plotting = True):
 
     # --save the ugv points as the road network graph ---# 
 
-    def add_edges_from_branch(branch):
-        for i in range(len(branch) - 1):
-            u = tuple(branch[i])
-            v = tuple(branch[i+1])
-            dist = np.linalg.norm(np.array(v) - np.array(u))*5280  # Convert to feet
-            G.add_edge(u, v, weight=dist)
+    import networkx as nx     # only the networkx scenarios need it, not the corpus workers
+    u, v, weights = branch_edges([A, B, C])
+    G = nx.Graph()
+    G.add_weighted_edges_from(zip(map(tuple, u), map(tuple, v), weights))
+
+    data['UGV_graph'] = G
+    
+    return data
 
 
-    G = nx.Graph()
+def branch_edges(branches):
+    """
+    Returns (u, v, weights) of the road edges joining consecutive points of every branch, weights in feet.
+    """
+    u = np.vstack([branch[:-1] for branch in branches])
+    v = np.vstack([branch[1:] for branch in branches])
+    delta = v - u
+    # row wise dot products, bit identical to np.linalg.norm of every single edge #
+    return u, v, np.sqrt((delta[:, None, :] @ delta[:, :, None]).ravel())*5280
 
-    # Add edges from each branch
-    add_edges_from_branch(A)
-    add_edges_from_branch(B)
-    add_edges_from_branch(C) 
 
-    data['UGV_graph'] = G
+def road_csr(u, v, weights):
+    """
+    Returns the road graph of the edges (u, v, weights) in CSR form (nodes, indptr, indices, weights),
+    without networkx. Nodes are numbered in order of first appearance and each node lists its
+    neighbours in edge order, as networkx does when the edges are added one by one.
+    """
+    endpoints = np.empty((2*len(u), 2))
+    endpoints[0::2], endpoints[1::2] = u, v
+    unique, first, inverse = np.unique(endpoints, axis=0, return_index=True, return_inverse=True)
+    order = np.argsort(first)
+    rank = np.empty_like(order)
+    rank[order] = np.arange(len(order))
+    ids = rank[inverse.ravel()]
+    nodes = unique[order]
+
+    # both directions of every edge, a self loop (repeated rounded point) only once #
+    src, dst = np.empty(2*len(u), dtype=np.int64), np.empty(2*len(u), dtype=np.int64)
+    src[0::2], src[1::2] = ids[0::2], ids[1::2]
+    dst[0::2], dst[1::2] = ids[1::2], ids[0::2]
+    arc_weights = np.repeat(weights, 2)
+    keep = np.ones(len(src), dtype=bool)
+    keep[1::2] = ids[0::2] != ids[1::2]
+    src, dst, arc_weights = src[keep], dst[keep], arc_weights[keep]
+
+    # first occurrence of every arc, grouped by source node #
+    _, first_arc = np.unique(src*len(nodes) + dst, return_index=True)
+    first_arc.sort()
+    src, dst, arc_weights = src[first_arc], dst[first_arc], arc_weights[first_arc]
+    by_node = np.argsort(src, kind='stable')
+    indptr = np.concatenate(([0], np.cumsum(np.bincount(src, minlength=len(nodes)))))
+    return nodes, indptr.astype(np.int64), dst[by_node], arc_weights[by_node]
+
+
+def generate_scenario_arrays(rng, points_per_branch, coord_max, type, num_uav_points = None, branches = 3):
+    """
+    Vectorized generator of one scenario for corpus mode. The road has a first branch from a corner to a
+    hub and branches - 1 branches from the hub to further corners, each of points_per_branch points.
+    rng is a numpy Generator. Returns a dict of arrays: UGV_X, UGV_Y, UAV_X, UAV_Y and the road graph
+    in CSR form (nodes, indptr, indices, weights).
+    """
+    corners = rng.integers(1, coord_max, size=(branches + 1, 2), endpoint=True)
+    hub = corners[1]
+    ends = [(corners[0], hub)] + [(hub, corners[k]) for k in range(2, branches + 1)]
+    road = [np.round(np.linspace(a, b, points_per_branch), 2) for a, b in ends]
+    points = np.vstack(road)
+
+    if type == 'A':
+        uav = points
+    else:
+        # random offsets of 0.5 to 4 miles (uav's fuel radius) around randomly selected road points #
+        selected = rng.choice(len(points), num_uav_points, replace=False)
+        radius = rng.uniform(0.5, 4.0, num_uav_points)
+        angle = rng.uniform(0, 2*math.pi, num_uav_points)
+        uav = np.round(points[selected] + np.column_stack((radius*np.cos(angle), radius*np.sin(angle))), 2)
+
+    nodes, indptr, indices, weights = road_csr(*branch_edges(road))
+    return {'UGV_X': points[:, 0], 'UGV_Y': points[:, 1], 'UAV_X': uav[:, 0], 'UAV_Y': uav[:, 1],
+            'nodes': nodes, 'indptr': indptr, 'indices': indices, 'weights': weights}
+
+
+def generate_shard(args):
+    """
+    Worker of generate_corpus: generates the scenarios of one shard from their seeds and writes the shard.
+    """
+    file_path, seeds, spec = args
+    scenarios = [generate_scenario_arrays(np.random.default_rng(seed), **spec) for seed in seeds]
+    save_shard(scenarios, file_path)
+    return [(len(scenario['UGV_X']), len(scenario['UAV_X']), len(scenario['nodes'])) for scenario in scenarios]
+
+
+def generate_corpus(count, seed, output_folder, shard_size = 1000, workers = None, **spec):
+    """
+    Generates count reproducible scenarios (scenario k is generated from the k-th child of
+    SeedSequence(seed), whatever the number of workers or the shard size) on a process pool. Writes
+    them into <output_folder>/shard_<n>.npz files and lists them in <output_folder>/index.csv;
+    the 'file' column (shard_<n>.npz#<position>) can be given to the solver and the batch runner.
+    Without a seed, fresh entropy is drawn and written to the 'seed' column to regenerate the corpus.
+    """
+    os.makedirs(output_folder, exist_ok=True)
+    root = np.random.SeedSequence(seed)
+    seed = root.entropy
+    seeds = root.spawn(count)
+    shards = [('shard_{:05d}.npz'.format(n), seeds[start:start + shard_size])
+              for n, start in enumerate(range(0, count, shard_size))]
+    
+    index_path = os.path.join(output_folder, 'index.csv')
+    with ProcessPoolExecutor(max_workers=workers) as pool, open(index_path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['id', 'file', 'shard', 'position', 'seed', 'type', 'branches', 'n_ugv_points', 'n_uav_points', 'n_nodes'])
+        jobs = [(os.path.join(output_folder, name), shard_seeds, spec) for name, shard_seeds in shards]
+        scenario_id = 0
+        for (name, _), sizes in zip(shards, pool.map(generate_shard, jobs)):
+            for position, (n_ugv, n_uav, n_nodes) in enumerate(sizes):
+                writer.writerow([scenario_id, '{}#{}'.format(name, position), name, position, seed, spec['type'],
+                                 spec.get('branches', 3), n_ugv, n_uav, n_nodes])
+                scenario_id += 1
+    print('{} scenarios written to {} ({} shards)'.format(count, output_folder, len(shards)))
+    return index_path
+
+
+def scenatio_generator(scale, type, plotting = True, format = 'pkl', artifacts = False, seed = None):
+    """
+    Generates a scenario based on the given scale and type. With artifacts, the road all-pairs distance
+    and predecessor matrices and the ugv stop to mission point distances are saved with it.
+    """
+    
+    rng = random if seed is None else random.Random(seed)
+    data = generate_scenario(type=type, rng=rng, **SCALES[scale])
+    if artifacts:
+        data.update(compute_artifacts(data))
+    X, Y = data['UGV_X'], data['UGV_Y']
+    G = data['UGV_graph']
 
 
     ## --save the data ---#
 
     output_folder = "scenarios"
     os.makedirs(output_folder, exist_ok=True)
-    file_path = os.path.join(output_folder, '{}_scenario_data.pkl'.format(scale))
-    with open(file_path, 'wb') as f:
-        pickle.dump(data, f)
+    file_path = os.path.join(output_folder, '{}_scenario_data.{}'.format(scale, format))
+    save_scenario(data, file_path)
 
 
 
@@ -152,6 +241,8 @@ def scenatio_generator(scale, type, plotting = True):
 
 
     if plotting:
+        import networkx as nx
+        import matplotlib.pyplot as plt
         # Plot the graph
         pos = {node: node for node in G.nodes()}
         
@@ -204,10 +295,47 @@ if __name__ == "__main__":
     default=True,
     help="Set plotting True or False"
 )
+    parser.add_argument("--format", type=str, default='pkl', choices=["pkl", "npz"],
+                        help="Scenario file format: pickle, or compact NumPy arrays with a CSR road graph")
+    parser.add_argument(
+    "--artifacts",
+    type=lambda x: (str(x).lower() == 'true'),
+    default=False,
+    help="Also save the road shortest path and UAV distance matrices so that the solver does not recompute them"
+)
+
+    parser.add_argument("--seed", type=int, default=None,
+                        help="Random seed (reproducible scenarios); in corpus mode the seed drawn when it is not given is written to index.csv")
+    parser.add_argument("--count", type=int, default=None,
+                        help="Corpus mode: number of scenarios to generate into sharded .npz files with an index")
+    parser.add_argument("--branches", type=int, default=3,
+                        help="Corpus mode: number of road branches")
+    parser.add_argument("--points_per_branch", type=int, default=None,
+                        help="Corpus mode: points per branch (default: from --scale)")
+    parser.add_argument("--coord_max", type=int, default=None,
+                        help="Corpus mode: maximum corner coordinate in miles (default: from --scale)")
+    parser.add_argument("--num_uav_points", type=int, default=None,
+                        help="Corpus mode: UAV points of a Type B scenario (default: from --scale)")
+    parser.add_argument("--shard_size", type=int, default=1000,
+                        help="Corpus mode: scenarios per shard file")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(),
+                        help="Corpus mode: number of worker processes")
+    parser.add_argument("--output", type=str, default=os.path.join('scenarios', 'corpus'),
+                        help="Corpus mode: output folder of the shards and index.csv")
 
     args = parser.parse_args()
+    if args.branches < 1:
+        parser.error('--branches must be at least 1')
 
-    scenatio_generator(scale=args.scale, type=args.type, plotting=args.plotting)
+    if args.count is None:
+        scenatio_generator(scale=args.scale, type=args.type, plotting=args.plotting, format=args.format, artifacts=args.artifacts,
+                           seed=args.seed)
+    else:
+        spec = dict(SCALES[args.scale], type=args.type, branches=args.branches)
+        for key in ['points_per_branch', 'coord_max', 'num_uav_points']:
+            if getattr(args, key) is not None:
+                spec[key] = getattr(args, key)
+        generate_corpus(args.count, args.seed, args.output, args.shard_size, args.workers, **spec)
 
         
 
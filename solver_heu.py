@@ -16,23 +16,61 @@
 '''
 
 import numpy as np
-from ortools.sat.python import cp_model
-import matplotlib.pyplot as plt
-import pandas as pd
 import time
 from ortools.constraint_solver import routing_enums_pb2
 from ortools.constraint_solver import pywrapcp
-import numpy as np
-import pandas as pd
-import matplotlib.pyplot as plt
-import time
-import networkx as nx
-import matplotlib.pyplot as plt
-from termcolor import cprint
 import os
-import pickle
-from matplotlib.patches import Circle
+import sys
+import json
+from concurrent.futures import ProcessPoolExecutor
+from scenario_io import load_scenario, scenario_csr, csr_distance_oracle, euclidean_ft
+import multiprocessing
+import itertools
+import logging
+
+logger = logging.getLogger(__name__)
+
+# number of set bits of every byte, for the bitset set cover (np.bitwise_count from numpy 2) #
+_POPCOUNT_TABLE = np.array([bin(k).count('1') for k in range(256)], dtype=np.uint8)
+popcount = getattr(np, 'bitwise_count', lambda bits: np.take(_POPCOUNT_TABLE, bits))
+
+
+# matplotlib, networkx, CP-SAT and termcolor are imported where they are used, so that runs without
+# plotting (batch workers, short SS runs) do not pay for them at start up #
+
+def pyplot(plot_dir = None):
+    '''
+    imports matplotlib.pyplot when the first figure is drawn; with a plot_dir the figures are rendered
+    to files with the non-interactive Agg backend instead of opening windows'''
+    import matplotlib
+    if plot_dir:
+        matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    return plt
+
+
+def show_figure(fig, plot_dir, name):
+    '''
+    shows a figure, or saves it as <plot_dir>/<name>.png and closes it in headless mode'''
+    plt = pyplot(plot_dir)
+    if plot_dir:
+        os.makedirs(plot_dir, exist_ok=True)
+        fig.savefig(os.path.join(plot_dir, '{}.png'.format(name)))
+        plt.close(fig)
+    else:
+        plt.show()
+
 
+def log_banner(message, color):
+    '''
+    logs message at INFO level, coloured with termcolor only when it is shown on a terminal (the logging
+    handler writes to stderr), so that redirected output and log files stay free of ANSI codes'''
+    if not logger.isEnabledFor(logging.INFO):
+        return
+    if sys.stdout.isatty() and sys.stderr.isatty():
+        from termcolor import colored
+        message = colored(message, color, attrs = ['bold'])
+    logger.info(message)
 
      
 class Major_Replan():
@@ -72,14 +110,64 @@ class Major_Replan():
         self.UGV_stop_location = []
         self.UGV_route_plan = []
         self.UAV_route_plan = {}
-        self.recharge_map_dict = {ugv_data_points[i]: i for i in range(len(ugv_data_points))}
         
-        self.map_dict = {ugv_data_points[i]: len(ugv_data_points) + i for i in range(len(ugv_data_points))}
-        self.map_dict.update({uav_data_points[i]: len(ugv_data_points) + len(ugv_data_points) + i for i in range(len(uav_data_points))})
+        # points are handled internally by contiguous integer ids (ugv points first, then the other uav points);
+        # coordinates are only translated (point_id / points) where they enter or leave the planner #
+        self.points = list(dict.fromkeys(ugv_data_points + uav_data_points + Targets + [starting]))
+        self.point_id = {self.points[k]: k for k in range(len(self.points))}
+        self.point_coordinates = np.array(self.points, dtype=float).reshape(-1, 2)
+        self.is_ugv_point = np.zeros(len(self.points), dtype=bool)
+        self.is_ugv_point[self.ids(ugv_data_points)] = True
+        
+        # action index of every point: recharging at a ugv point, visiting a ugv / uav point #
+        self.recharge_action = np.full(len(self.points), -1, dtype=np.int64)
+        self.visit_action = np.full(len(self.points), -1, dtype=np.int64)
+        for i in range(len(ugv_data_points)):
+            self.recharge_action[self.point_id[ugv_data_points[i]]] = i
+            self.visit_action[self.point_id[ugv_data_points[i]]] = len(ugv_data_points) + i
+        for i in range(len(uav_data_points)):
+            self.visit_action[self.point_id[uav_data_points[i]]] = len(ugv_data_points) + len(ugv_data_points) + i
         self.action_heu = []
         self.stop_locations = []
-        self.road_network_graph = None
+        self.road_network = None         # (nodes, indptr, indices, weights) CSR road network, see scenario_io.scenario_csr
+        self.road_index = None           # point id -> row of the road distance matrices (-1 off the road network)
+        self.road_point_id = None        # row of the road distance matrices -> point id
+        self.road_distance_matrix = None
+        self.road_predecessors = None
+        self.coverage = None
+        self.coverage_artifact = None    # (stops, targets, distance) saved with the scenario, see load_artifacts
+        self.set_cover_engine = 'cpsat'  # 'cpsat' (exact, hinted with greedy_local), 'greedy' or 'greedy_local'
+        self.set_cover_pruning = True    # remove duplicate and dominated candidate stops and fix the unique covers before the set cover
+        self.set_cover_time = 10         # s, time limit of the exact CP-SAT set cover
+        self.set_cover_workers = None    # CP-SAT search workers of the set cover (None: CP-SAT default, one per core)
+        self.set_cover_hint = True       # hint the CP-SAT set cover with the greedy_local cover
+        self.set_cover_log = False       # log the CP-SAT search progress of the set cover (through the logger, at INFO)
+        self.tour_engine = 'auto'        # ugv tour over the refuel stops: 'auto' (Held-Karp, 2-opt / Or-opt above held_karp_max stops) or 'ortools'
+        self.held_karp_max = 15          # largest number of refuel stops (besides the start) ordered exactly by Held-Karp
+        self.first_solution_strategy = 'PATH_MOST_CONSTRAINED_ARC'
+        self.portfolio = None         # list of 'METAHEURISTIC' or 'METAHEURISTIC:FIRST_SOLUTION_STRATEGY' raced by UAV_planner
+        self.portfolio_target = None  # stop the race once a run reaches this objective
+        self.target_objective = None  # cancel a UAV_planner search once a solution reaches this objective (set on portfolio runs)
+        self.adaptive_time = False      # scale the UAV_planner time limit with the number of mission points
+        self.time_per_point = 0.5       # s of search per mission point when adaptive_time
+        self.min_solver_time = 2        # s, lower bound of the adaptive time limit
+        self.stagnation_time = None     # stop the search when the objective has not improved for this many s
+        self.stagnation_solutions = None   # ... or for this many solutions
+        self.multi_sortie = False        # one UAV_planner model per subproblem instead of re-solving its dropped points
+        self.max_sorties = 3             # sortie segments of the single multi-sortie model
+        self.warm_start_retries = True   # seed the dropped-point retries of a subproblem with greedy_sortie_route
+        self.solution_limit = None       # stop a UAV_planner search after this many solutions (fixed work for benchmarks)
+        self.random_seed = None
+        self.last_objective = None
+        self.last_status = None
+        self.last_build_time = None
+        self.last_search_time = None
+        self.unreachable_targets = []    # mission points outside the fuel radius of every refuel stop (set by Allocation_function)
+        self.last_route = None           # structured result of the last UAV_planner call (nodes, times, fuel, dropped points)
+        self.metrics = {'calls': [], 'counters': {'cu_dis1': 0, 'path_': 0, 'dijkstra': 0}}
+        self.trace_file = None           # JSON lines file receiving every metrics record as it is made
         self.plotting = False
+        self.plot_dir = None             # headless plotting: figures are saved in this folder instead of shown
         
         
         
@@ -90,13 +178,182 @@ class Major_Replan():
             
                      
 
+    def record(self, stage, wall_time, **stats):
+          '''
+          adds one call of a stage to self.metrics: its wall time (s) and the model sizes / solver
+          statistics given as keywords. The record is also appended to self.trace_file as a JSON line.'''
+          entry = dict(stats, stage=stage, wall_time=wall_time)
+          self.metrics['calls'].append(entry)
+          if self.trace_file:
+              with open(self.trace_file, 'a') as f:
+                  f.write(json.dumps(entry, default=str) + '\n')
+          return entry
+
+    def metrics_mark(self):
+          '''
+          position of the metrics, to collect with metrics_since what a worker process added after it'''
+          return len(self.metrics['calls']), dict(self.metrics['counters'])
+
+    def metrics_since(self, mark):
+          calls, counters = mark
+          return {'calls': self.metrics['calls'][calls:],
+                  'counters': {key: value - counters[key] for key, value in self.metrics['counters'].items()}}
+
+    def merge_metrics(self, metrics):
+          '''
+          adds the metrics collected by a worker process (metrics_since) to self.metrics'''
+          self.metrics['calls'] += metrics['calls']
+          for key, value in metrics['counters'].items():
+              self.metrics['counters'][key] += value
+
+    def metrics_summary(self):
+          '''
+          returns the metrics as a JSON serialisable dict: number of calls and total wall time of every
+          stage, the shortest path counters and the record of every call'''
+          stages = {}
+          for entry in self.metrics['calls']:
+              stage = stages.setdefault(entry['stage'], {'calls': 0, 'wall_time': 0.0})
+              stage['calls'] += 1
+              stage['wall_time'] += entry['wall_time']
+          return {'stages': stages, 'counters': dict(self.metrics['counters']), 'calls': list(self.metrics['calls'])}
+
+    def build_road_distance_oracle(self):
+          '''
+          runs single-source Dijkstra from every node of the ugv road network once and stores
+          the all-pairs road distances (ft) in a dense integer matrix indexed by node id,
+          together with the predecessor matrix used to rebuild the paths'''
+          start = time.time()
+          nodes, indptr, indices, weights = self.road_network
+          distance, predecessors = csr_distance_oracle(indptr, indices, weights)
+          self.index_road_nodes(nodes)
+          self.road_distance_matrix = distance
+          self.road_predecessors = predecessors
+          self.metrics['counters']['dijkstra'] += len(nodes)
+          self.record('road_distance_oracle', time.time() - start, nodes=len(nodes), edges=len(indices)//2)
+          return distance
+
+    def load_artifacts(self, data):
+          '''
+          uses the distance artifacts saved with a scenario (scenario_io.compute_artifacts) instead of
+          recomputing them; artifacts that do not match the road graph or the points are ignored'''
+          start = time.time()
+          loaded = []
+          nodes = self.road_network[0]
+          if 'road_distance' in data and data['road_distance'].shape == (len(nodes), len(nodes)):
+              self.index_road_nodes(nodes)
+              self.road_distance_matrix = np.asarray(data['road_distance'], dtype=np.int64)
+              self.road_predecessors = np.asarray(data['road_predecessors'], dtype=np.int64)
+              loaded.append('road')
+          if 'coverage_distance' in data:
+              self.coverage_artifact = (data['coverage_stops'], data['coverage_targets'], data['coverage_distance'])
+              loaded.append('coverage')
+          self.record('load_artifacts', time.time() - start, artifacts=loaded)
+          return loaded
+    
+    def ids(self, points):
+          '''
+          integer ids of a list of coordinate tuples'''
+          return np.array([self.point_id[p] for p in points], dtype=np.int64)
+
+    def index_road_nodes(self, nodes):
+          '''
+          maps the point ids to the rows of the road distance matrices, whose nodes (coordinates) are in the given order'''
+          self.road_point_id = self.ids([tuple(node) for node in nodes])
+          self.road_index = np.full(len(self.points), -1, dtype=np.int64)
+          self.road_index[self.road_point_id] = np.arange(len(nodes))
+
+    def road_rows(self, ids):
+          '''
+          rows of the road distance matrices of the point ids (scalar or array); raises NodeNotFound for a
+          point that is not on the road network'''
+          if self.road_distance_matrix is None:
+              self.build_road_distance_oracle()
+          rows = self.road_index[ids]
+          if np.any(rows < 0):
+              import networkx as nx
+              off_road = np.atleast_1d(ids)[np.atleast_1d(rows) < 0]
+              raise nx.NodeNotFound('Points {} are not on the road network.'.format([self.points[k] for k in off_road]))
+          return rows
+
+    def road_distance(self, a, b):
+          '''
+          road distance (ft) between the points of ids a and b (scalars or arrays); raises NetworkXNoPath
+          when two of them are not connected by the road network'''
+          rows, columns = self.road_rows(a), self.road_rows(b)
+          distance = self.road_distance_matrix[rows, columns]
+          if np.any(distance < 0):
+              import networkx as nx
+              a, b = np.broadcast_arrays(a, b)
+              k = np.flatnonzero(np.atleast_1d(distance) < 0)[0]
+              raise nx.NetworkXNoPath('No path between {} and {}.'.format(*(tuple(map(float, self.points[np.atleast_1d(p)[k]])) for p in (a, b))))
+          return distance
+
     def cu_dis1 (self,node1,node2):
           '''
           returns the distance between two nodes in the ugv road network'''
-          G = self.road_network_graph   
-          path = nx.shortest_path(G, source=node1, target=node2, weight='weight')
-          distance = int(sum(G[path[i]][path[i + 1]]['weight'] for i in range(len(path) - 1)))
-          return distance               
+          self.metrics['counters']['cu_dis1'] += 1
+          return int(self.road_distance(self.point_id[node1], self.point_id[node2]))
+
+    def road_distance_submatrix(self, ids):
+          '''
+          returns the road distance matrix (ft) between the ugv points of the given ids as an n x n integer array'''
+          rows = self.road_rows(ids)
+          return self.road_distance_matrix[np.ix_(rows, rows)]
+
+    def solver_budget(self, n_points):
+          '''
+          returns the time limit (s) of one UAV_planner call. With adaptive_time it scales with the number of
+          mission points of the subproblem, bounded by min_solver_time and solver_time'''
+          if not self.adaptive_time:
+              return self.solver_time
+          return min(self.solver_time, max(self.min_solver_time, self.time_per_point*n_points))
+
+    def build_coverage(self):
+          '''
+          computes once the euclidean distance (ft) between every ugv point (candidate refuel stop)
+          and every mission point, and whether the uav can reach the mission point from the stop
+          within half of its fuel radius'''
+          start = time.time()
+          stops = np.unique(self.ids(self.ugv_data_points + [self.starting]))
+          targets = np.unique(self.ids(self.Targets))
+          stop_coordinates = self.point_coordinates[stops]
+          target_coordinates = self.point_coordinates[targets]
+          
+          if self.coverage_artifact is not None and np.array_equal(self.coverage_artifact[0], stop_coordinates) \
+                  and np.array_equal(self.coverage_artifact[1], target_coordinates):
+              distance = np.asarray(self.coverage_artifact[2], dtype=np.int64)
+          else:
+              distance = euclidean_ft(stop_coordinates, target_coordinates)
+          
+          stop_row = np.full(len(self.points), -1, dtype=np.int64)
+          stop_row[stops] = np.arange(len(stops))
+          target_column = np.full(len(self.points), -1, dtype=np.int64)
+          target_column[targets] = np.arange(len(targets))
+          self.coverage = {'stops': stops,
+                           'stop_row': stop_row,
+                           'targets': targets,
+                           'target_column': target_column,
+                           'distance': distance,
+                           'covers': (198*distance/self.uav_speed) <= (self.Fuel_limit/2)}
+          self.record('coverage', time.time() - start, stops=len(stops), targets=len(targets))
+          return self.coverage
+    
+    def coverage_submatrix(self, stops, targets):
+          '''
+          returns (distance, covers) of the given stop ids (rows) and mission point ids (columns)'''
+          if self.coverage is None:
+              self.build_coverage()
+          grid = np.ix_(self.coverage['stop_row'][stops], self.coverage['target_column'][targets])
+          return self.coverage['distance'][grid], self.coverage['covers'][grid]
+    
+    def nearest_covering_stop(self, stops, targets):
+          '''
+          returns, for every mission point id, the position in stops of the nearest stop that covers it (-1 if none)'''
+          distance, covers = self.coverage_submatrix(stops, targets)
+          if len(stops) == 0:
+              return np.full(len(targets), -1, dtype=np.int64)
+          nearest = np.argmin(np.where(covers, distance, np.iinfo(np.int64).max), axis=0)
+          return np.where(covers.any(axis=0), nearest, -1)
 
     def path_(self,Stop1,Stop2):
         
@@ -118,21 +375,28 @@ class Major_Replan():
             time taken to travel along the path.
          '''
         
-         G = self.road_network_graph   
-         if Stop1 == Stop2:
-             path = [Stop1,Stop1]
-         else:
-             path = nx.shortest_path(G, source=Stop1, target = Stop2, weight='weight')
+         path = self.path_ids(self.point_id[Stop1], self.point_id[Stop2])
          
-         path = [i for i in path if i  in self.ugv_data_points]
-         
-         Time = []
-         t = 0
-         for i in range(len(path)-1):
-             t = t+ self.cu_dis1(path[i],path[i+1])/self.ugv_speed
-             Time.append((int(t),600000000))
+         Time = [(int(t),600000000) for t in np.cumsum(self.road_distance(path[:-1], path[1:])/self.ugv_speed)]
              
-         return path,Time                  
+         return [self.points[k] for k in path],Time                  
+
+    def path_ids(self, s, t):
+         '''
+         ids of the ugv points along the shortest road path from point id s to point id t ([s, s] when s == t)'''
+         self.metrics['counters']['path_'] += 1
+         rs, rt = self.road_rows(s), self.road_rows(t)
+         if s == t:
+             path = np.array([s, s], dtype=np.int64)
+         else:
+             if self.road_distance_matrix[rs, rt] < 0:
+                 import networkx as nx
+                 raise nx.NetworkXNoPath('No path between {} and {}.'.format(self.points[s], self.points[t]))
+             node_path = [rt]
+             while node_path[-1] != rs:
+                 node_path.append(self.road_predecessors[rs, node_path[-1]])
+             path = self.road_point_id[node_path[::-1]]
+         return path[self.is_ugv_point[path]]
                           
                       
     
@@ -140,6 +404,229 @@ class Major_Replan():
    
         
 
+    def greedy_set_cover(self, covers, cost):
+          '''
+          greedy set cover of the boolean coverage matrix (candidate stops x targets, every target covered by
+          at least one candidate): repeatedly selects the stop covering the most uncovered targets, the
+          cheapest one on ties. The rows are packed into bitsets so that a round is one popcount per stop.
+          Returns the rows of the selected stops'''
+          start = time.time()
+          bits = np.packbits(covers, axis=1)
+          uncovered = np.packbits(np.ones(covers.shape[1], dtype=bool))
+          rows = np.arange(covers.shape[0])
+          selected = []
+          while uncovered.any():
+              words = np.flatnonzero(uncovered)        # only the bytes with uncovered targets left
+              gain = popcount(bits[:, words] & uncovered[words]).sum(axis=1, dtype=np.int64)
+              best = np.flatnonzero(gain == gain.max())
+              best = best[np.argmin(cost[rows[best]])]
+              selected.append(int(rows[best]))
+              uncovered &= ~bits[best]
+              keep = gain > 0                          # stops that covered nothing new never will
+              keep[best] = False
+              bits, rows = bits[keep], rows[keep]
+          self.record('set_cover_greedy', time.time() - start, candidates=covers.shape[0], targets=covers.shape[1],
+                      selected=len(selected))
+          return selected
+    
+    def improve_set_cover(self, covers, selected, cost):
+          '''
+          local improvement of a set cover: drops the redundant stops (most expensive first) and replaces
+          two selected stops by a single one covering all the targets only they cover, until neither applies'''
+          start = time.time()
+          selected = list(selected)
+          count = covers[selected].sum(axis=0)      # selected stops covering every target
+          size = len(selected)
+          improved = True
+          while improved:
+              improved = False
+              for k in sorted(selected, key=lambda k: -cost[k]):
+                  if (count[covers[k]] > 1).all():
+                      selected.remove(k)
+                      count -= covers[k]
+              for a, b in itertools.combinations(selected, 2):
+                  need = (covers[a] | covers[b]) & (count - covers[a] - covers[b] == 0)
+                  replacement = np.flatnonzero(covers[:, need].all(axis=1))
+                  if len(replacement):
+                      k = int(replacement[np.argmin(cost[replacement])])
+                      selected = [s for s in selected if s != a and s != b] + [k]
+                      count = count - covers[a] - covers[b] + covers[k]
+                      improved = True
+                      break
+          self.record('set_cover_local', time.time() - start, initial=size, selected=len(selected))
+          return selected
+    
+    def cpsat_set_cover(self, covers, hint):
+          '''
+          exact minimum set cover with CP-SAT, one boolean per candidate stop and one clause per target,
+          hinted with the heuristic cover hint (set_cover_hint) and stopped after set_cover_time s, with
+          set_cover_workers search workers. Returns the best cover found, OPTIMAL or FEASIBLE, or hint when
+          CP-SAT finds none within the time limit'''
+          from ortools.sat.python import cp_model
+          model = cp_model.CpModel()
+          point_vars = [model.NewBoolVar('Point {}'.format(k)) for k in range(covers.shape[0])]
+          for column in covers.T:
+              model.AddBoolOr([point_vars[k] for k in np.flatnonzero(column)])
+          model.Minimize(sum(point_vars))
+          if self.set_cover_hint:
+              hinted = set(hint)
+              for k in range(len(point_vars)):
+                  model.AddHint(point_vars[k], k in hinted)
+          
+          solver = cp_model.CpSolver()
+          solver.parameters.max_time_in_seconds = self.set_cover_time
+          if self.set_cover_workers is not None:
+              solver.parameters.num_workers = self.set_cover_workers
+          if self.set_cover_log:
+              solver.parameters.log_search_progress = True
+              solver.parameters.log_to_stdout = False
+              solver.log_callback = logger.info
+          if self.random_seed is not None:
+              solver.parameters.random_seed = self.random_seed
+          status = solver.Solve(model)
+          self.record('set_cover_cpsat', solver.WallTime(), variables=len(point_vars), constraints=len(model.Proto().constraints),
+                      time_limit=self.set_cover_time, workers=self.set_cover_workers, hint=len(hint) if self.set_cover_hint else None,
+                      status=solver.StatusName(status), objective=solver.ObjectiveValue(), best_bound=solver.BestObjectiveBound(),
+                      branches=solver.NumBranches(), conflicts=solver.NumConflicts())
+          
+          if status in (cp_model.OPTIMAL, cp_model.FEASIBLE):
+              return [k for k in range(len(point_vars)) if solver.Value(point_vars[k])]
+          logger.warning('CP-SAT set cover found no solution within %s s, using the heuristic cover', self.set_cover_time)
+          return list(hint)
+
+    def held_karp_tour(self, distance):
+          '''
+          exact shortest closed tour from node 0 of the distance matrix by Held-Karp dynamic programming,
+          vectorized over the subsets of each size: O(2^n n^2) work, for up to held_karp_max stops.
+          Returns the node order starting at 0'''
+          m = len(distance) - 1
+          if m <= 1:
+              return list(range(m + 1))
+          d = np.asarray(distance, dtype=np.int64)
+          inf = np.iinfo(np.int64).max // 4
+          cost = np.full((1 << m, m), inf, dtype=np.int64)     # cost[S, j]: from 0 through the stops of S, ending at j
+          parent = np.full((1 << m, m), -1, dtype=np.int64)
+          cost[1 << np.arange(m), np.arange(m)] = d[0, 1:]
+          masks = np.arange(1 << m)
+          size = sum((masks >> j) & 1 for j in range(m))        # number of stops of every subset
+          for k in range(2, m + 1):
+              layer = masks[size == k]
+              for j in range(m):
+                  S = layer[(layer >> j) & 1 == 1]
+                  previous = cost[S ^ (1 << j)] + d[1:, j + 1]
+                  parent[S, j] = np.argmin(previous, axis=1)
+                  cost[S, j] = previous[np.arange(len(S)), parent[S, j]]
+          S = (1 << m) - 1
+          j = int(np.argmin(cost[S] + d[1:, 0]))
+          order = []
+          while j >= 0:
+              order.append(j + 1)
+              S, j = S ^ (1 << j), int(parent[S, j])
+          return [0] + order[::-1]
+    
+    def local_search_tour(self, distance):
+          '''
+          closed tour from node 0 of a symmetric distance matrix: nearest neighbour construction improved
+          with 2-opt (best move of each pass) and Or-opt (moves of segments of 1 to 3 stops) until neither
+          improves. Returns the node order starting at 0'''
+          d = np.asarray(distance, dtype=np.int64)
+          n = len(d)
+          tour = [0]
+          left = set(range(1, n))
+          while left:
+              nearest = min(left, key=lambda k: (d[tour[-1], k], k))
+              tour.append(nearest)
+              left.remove(nearest)
+          
+          improved = True
+          while improved:
+              improved = False
+              # 2-opt: replace the edges (t[i], t[i+1]), (t[j], t[j+1]) by (t[i], t[j]), (t[i+1], t[j+1]) #
+              t = np.array(tour + [0])
+              a, b = t[:-1], t[1:]
+              delta = d[a[:, None], a[None, :]] + d[b[:, None], b[None, :]] - d[a, b][:, None] - d[a, b][None, :]
+              delta[np.tril_indices(len(a), 1)] = 0
+              i, j = np.unravel_index(np.argmin(delta), delta.shape)
+              if delta[i, j] < 0:
+                  tour = tour[:i+1] + tour[i+1:j+1][::-1] + tour[j+1:]
+                  improved = True
+                  continue
+              # Or-opt: move the segment tour[i:i+length] between two other consecutive stops #
+              for length in (1, 2, 3):
+                  for i in range(1, n - length + 1):
+                      segment = tour[i:i+length]
+                      rest = tour[:i] + tour[i+length:]
+                      before, after = tour[i-1], tour[(i+length) % n]
+                      gain = d[before, segment[0]] + d[segment[-1], after] - d[before, after]
+                      r = np.array(rest + [0])
+                      forward = d[r[:-1], segment[0]] + d[segment[-1], r[1:]] - d[r[:-1], r[1:]]
+                      backward = d[r[:-1], segment[-1]] + d[segment[0], r[1:]] - d[r[:-1], r[1:]]
+                      p = int(np.argmin(np.minimum(forward, backward)))
+                      if min(forward[p], backward[p]) < gain:
+                          segment = segment if forward[p] <= backward[p] else segment[::-1]
+                          tour = rest[:p+1] + segment + rest[p+1:]
+                          improved = True
+                          break
+                  if improved:
+                      break
+          return tour
+
+    def prune_set_cover(self, covers, cost):
+          '''
+          dominance reduction of a set cover instance (boolean coverage matrix, candidate stops x targets):
+          collapses the stops with identical coverage into the cheapest one, removes the stops whose targets
+          are a subset of another stop's and fixes the stops that are the only cover of some target, until
+          nothing changes. Every minimum cover of the reduced instance plus the fixed stops is a minimum
+          cover of the original one. Returns (forced, rows, columns): the fixed stops, and the stops and
+          targets of the reduced instance'''
+          start = time.time()
+          rows = np.arange(covers.shape[0])
+          columns = np.arange(covers.shape[1])
+          forced = []
+          C = covers
+          while True:
+              bytes_ = np.packbits(C, axis=1)
+              words = np.zeros((len(rows), -(-bytes_.shape[1] // 8)), dtype=np.uint64)   # coverage of every stop as 64 bit words
+              words.view(np.uint8)[:, :bytes_.shape[1]] = bytes_
+              
+              # duplicates and empty stops: one stop per distinct coverage, the cheapest #
+              order = np.lexsort((rows, cost[rows]))
+              _, first = np.unique(words[order].view(np.dtype((np.void, 8*words.shape[1]))).ravel(), return_index=True)
+              keep = np.sort(order[first])
+              keep = keep[words[keep].any(axis=1)]
+              rows, C, words = rows[keep], C[keep], words[keep]
+              if len(rows) == 0:
+                  break
+              
+              # stops covering a strict subset of another stop's targets (the largest stop of every chain is
+              # kept); a superset must cover the stop's least covered target, so the stops are compared in
+              # groups of the same least covered target, against its covers only #
+              by_count = np.argsort(C.sum(axis=0), kind='stable')
+              rarest = by_count[np.argmax(C[:, by_count], axis=1)]
+              coverers = np.ascontiguousarray(C.T)
+              dominated = np.zeros(len(rows), dtype=bool)
+              order = np.argsort(rarest, kind='stable')
+              for group in np.split(order, np.flatnonzero(np.diff(rarest[order])) + 1):
+                  others = np.flatnonzero(coverers[rarest[group[0]]])
+                  inside = ((words[group][:, None, :] & ~words[others][None, :, :]) == 0).all(axis=2)
+                  inside[group[:, None] == others[None, :]] = False
+                  dominated[group] = inside.any(axis=1)
+              rows, C = rows[~dominated], C[~dominated]
+              
+              # targets with a single remaining cover fix that stop #
+              unique = C.sum(axis=0) == 1
+              if not unique.any():
+                  break
+              fixed = np.unique(np.argmax(C[:, unique], axis=0))
+              forced += rows[fixed].tolist()
+              open_targets = ~C[fixed].any(axis=0)
+              free = np.ones(len(rows), dtype=bool)
+              free[fixed] = False
+              rows, columns, C = rows[free], columns[open_targets], C[np.ix_(free, open_targets)]
+          self.record('set_cover_pruning', time.time() - start, candidates=covers.shape[0], targets=covers.shape[1],
+                      forced=len(forced), reduced_candidates=len(rows), reduced_targets=len(columns))
+          return forced, rows, columns
+
     def CP_set_cover(self,Targets,Locations,starting): 
         
         '''
@@ -149,110 +636,54 @@ class Major_Replan():
         
         '''
          
-        Targets = Targets.copy()
-        A = Locations.copy() 
-
-        def hit(point,targets):
-            hitted_targets = []
-            for j in range(len(targets)):
-                a = np.array(point)
-                b = np.array(targets[j])
-                d = int(np.sqrt(np.sum(np.square(a-b)))*5280)
-                if (198*d/self.uav_speed) <=(self.Fuel_limit/2):
-                    hitted_targets.append(j)            
-            return hitted_targets
+        set_cover_start = time.time()
+        Targets = self.ids(Targets)
+        A = self.ids(Locations).tolist()
         
         
-        starting = starting
-        hit_start= hit(starting,Targets)
-
-        
-        
-        remv=[]
-        for i in hit_start:
-            remv.append(Targets[i])
-        for i in remv:
-            Targets.remove(i)
+        # targets within reach of the starting location need no other stop #
+        start = self.point_id[starting]
+        _, covers_start = self.coverage_submatrix([start], Targets)
+        Targets = Targets[~covers_start[0]]
         
-        A.remove(starting)
+        A.remove(start)
+        rows, start_row = self.road_rows(np.array(A, dtype=np.int64)), self.road_rows(start)
+        reachable = self.road_distance_matrix[rows, start_row] >= 0
+        if not reachable.all():
+            logger.warning('%s candidate stops cannot be reached from the start on the road network and are skipped', int((~reachable).sum()))
+            A = [A[k] for k in np.flatnonzero(reachable)]
         
         
              
         ############## minimum hitting set #################
-
-        model = cp_model.CpModel()
-        hitted_dict = {}
-        point_vars= {}
-        target_set={}
-        hit_set={}
-        obj_var={}
-        objective_set={}
-        var = []
         
-        for i in range(len(Targets)):  
-           target_set.setdefault('Target {}'.format(i), set())  
-           hit_set.setdefault('Target {}'.format(i), set()) 
-
-        for i in range(len(A)):  
-           p_var= point_vars.setdefault('Point {}'.format(i), model.NewBoolVar('Point '+str(i)))
-           
-           hitted_dict.setdefault('{}'.format(i), set(hit(A[i],Targets)))
-           obj_var.setdefault('Point {}'.format(i),(self.cu_dis1(A[i],starting)))
+        _, covers = self.coverage_submatrix(A, Targets)
+        covers = covers[:, covers.any(axis=0)]     # targets out of reach of every stop are reported by Allocation_function
+        distance_to_start = self.road_distance(np.array(A, dtype=np.int64), start)
         
+        forced, rows, columns = [], np.arange(covers.shape[0]), np.arange(covers.shape[1])
+        if self.set_cover_pruning:
+            forced, rows, columns = self.prune_set_cover(covers, distance_to_start)
+        covers, cost = covers[np.ix_(rows, columns)], distance_to_start[rows]
         
-        for a, b in point_vars.items():
-               var.append(b)
-               
-        for a, b in obj_var.items():
-           objective_set.setdefault(a,(b*point_vars[a]))
-               
-        
-        for a, b in hitted_dict.items():
-               for k in b:
-                   hit_set['Target {}'.format(k)].add(a)
-
-        for a, b in hit_set.items():
-               for k in b:
-                   target_set['{}'.format(a)].add(list(point_vars.values())[int(k)])
-                    
-           
-        for a,b in target_set.items():
-            model.Add(sum(b) >= 1)  
-        #model.Minimize(sum(objective_set.values()))
-        model.Minimize(sum(point_vars.values()))  
-        solver = cp_model.CpSolver()
-        status = solver.Solve(model)
-        
-        if status == cp_model.OPTIMAL:
-             selected_points = [p for p in point_vars
-                              if solver.Value(point_vars[p])]
-             print('No of Rendzvous points: {}\n' .format((len(selected_points))+1))
-        else:
-             print('Unable to find an optimal solution')
+        selected_points = self.greedy_set_cover(covers, cost)
+        if self.set_cover_engine != 'greedy':
+            selected_points = self.improve_set_cover(covers, selected_points, cost)
+        if self.set_cover_engine == 'cpsat':
+            selected_points = self.cpsat_set_cover(covers, selected_points)
+        selected_points = forced + rows[selected_points].tolist()
+        logger.info('No of Rendzvous points: %s', len(selected_points)+1)
              
-        Locs=[]       
-        for i in selected_points:
-            a,b = i.split(" ")
-            Locs.append(A[int(b)])
+        Locs = [A[k] for k in sorted(selected_points)]
         
         
         
-        task_points =    [starting] + Locs #
+        task_points =    np.array([start] + Locs, dtype=np.int64) #
 
         def create_data_model():
     
             data = {}
-            distance = []
-            for i in range(len(task_points)):
-                    distance.append([])
-            for i in range(len(task_points)):
-                    for i in range(len(task_points)):
-                        for j in range(len(task_points)):
-                            a = task_points[i]
-                            b = task_points[j]
-                            d = int(self.cu_dis1(a,b))
-                            distance[i].append(d)
-            data["distance_matrix"] = distance
+            data["distance_matrix"] = self.road_distance_submatrix(task_points)
             data["num_vehicles"] = 1
             data["depot"] = 0
             return data
@@ -266,7 +697,7 @@ class Major_Replan():
             route_distance = 0
             route_order = []
             while not routing.IsEnd(index):
-                route_order.append( task_points[manager.IndexToNode(index)])
+                route_order.append(int(task_points[manager.IndexToNode(index)]))
                 plan_output += f" {manager.IndexToNode(index)} ->"
                 previous_index = index
                 index = solution.Value(routing.NextVar(index))
@@ -292,14 +723,7 @@ class Major_Replan():
             routing = pywrapcp.RoutingModel(manager)
 
 
-            def distance_callback(from_index, to_index):
-                """Returns the distance between the two nodes."""
-                # Convert from routing variable Index to distance matrix NodeIndex.
-                from_node = manager.IndexToNode(from_index)
-                to_node = manager.IndexToNode(to_index)
-                return data["distance_matrix"][from_node][to_node]
-
-            transit_callback_index = routing.RegisterTransitCallback(distance_callback)
+            transit_callback_index = routing.RegisterTransitMatrix(data["distance_matrix"].tolist())
 
             # Define cost of each arc.
             routing.SetArcCostEvaluatorOfAllVehicles(transit_callback_index)
@@ -311,7 +735,12 @@ class Major_Replan():
             )
             search_parameters.time_limit.FromSeconds(self.solver_time)
             # Solve the problem.
+            tsp_start = time.time()
             solution = routing.SolveWithParameters(search_parameters)
+            self.record('ugv_tsp', time.time() - tsp_start, nodes=len(task_points),
+                        status=routing_enums_pb2.RoutingSearchStatus.Value.Name(routing.status()),
+                        objective=solution.ObjectiveValue() if solution else None,
+                        solutions=routing.solver().Solutions(), branches=routing.solver().Branches())
 
             # Print solution on console.
             if solution:
@@ -319,12 +748,28 @@ class Major_Replan():
 
             return route_order
 
-        Locs = main()
-        Locs =  [starting] + list(dict.fromkeys(Locs))
+        ############## ugv tour over the selected stops #################
+        
+        if self.tour_engine == 'ortools':
+            Locs = main()
+        else:
+            tour_start = time.time()
+            distance = self.road_distance_submatrix(task_points)
+            if len(task_points) - 1 <= self.held_karp_max:
+                engine, order = 'held_karp', self.held_karp_tour(distance)
+            else:
+                engine, order = 'local_search', self.local_search_tour(distance)
+            if len(order) > 2 and distance[0, order[-1]] < distance[0, order[1]]:
+                order = [0] + order[1:][::-1]       # same tour, travelled from its nearest end like PATH_CHEAPEST_ARC
+            Locs = task_points[order].tolist()
+            self.record('ugv_tour', time.time() - tour_start, engine=engine, nodes=len(task_points),
+                        objective=int(distance[order, order[1:] + order[:1]].sum()))
+        Locs =  [starting] + [self.points[k] for k in dict.fromkeys(Locs)]
 
        
 
         self.stop_locations = Locs.copy()
+        self.record('set_cover', time.time() - set_cover_start, candidate_stops=len(A), targets=len(Targets), stops=len(Locs))
         
         return Locs
 
@@ -335,6 +780,7 @@ class Major_Replan():
         '''
         Allocation function for UAV mission points to UGV recharging locations
         '''
+        allocation_start = time.time()
         Allocation = {}
         Targets = Targets
         Locations = Locations
@@ -349,56 +795,48 @@ class Major_Replan():
         
         
         # UGV path determination #
-        UGV_path = []
-        
         if len(Refuel_stop_Locs) == 1: # if only one recharging location
             Refuel_stop_Locs = [Refuel_stop_Locs[0],Refuel_stop_Locs[0]]
+        stops = self.ids(Refuel_stop_Locs)
         
-        i = 1
-        while i < len(Refuel_stop_Locs): # creating the path
-              UGV_path_i,UGV_time = self.path_(Refuel_stop_Locs[i-1],Refuel_stop_Locs[i])
-              UGV_path = UGV_path + UGV_path_i
-              i = i+1
-            
-            
+        on_path = np.zeros(len(self.points), dtype=bool)    # mask of the point ids along the ugv path
+        for i in range(1, len(stops)):
+              on_path[self.path_ids(stops[i-1], stops[i])] = True
         
-        Locations_copy =  [x for x in Targets if x not in UGV_path]  # Target for UAV , not in UGV path
+        targets = self.ids(Targets)
+        Locations_copy = targets[~on_path[targets]]  # Target for UAV , not in UGV path
         
+        # every uav point goes to the nearest rf stop that covers it; points no stop covers are reported #
+        nearest = self.nearest_covering_stop(stops, Locations_copy)
+        self.unreachable_targets = [self.points[i] for i in Locations_copy[nearest < 0]]
+        if self.unreachable_targets:
+              logger.warning('%s mission points are not within the fuel radius of any refuel stop: %s',
+                             len(self.unreachable_targets), self.unreachable_targets)
         
-        Allc = {}
-
-        for i in Refuel_stop_Locs:
-              Allc.setdefault((i),[])
-
-        for i in Locations_copy :
-              Allocated = []
-              for j in Refuel_stop_Locs:
-                  a = np.array(i)
-                  b = np.array(j)
-                  d = int(np.sqrt(np.sum(np.square(a-b)))*5280)
-                  if d*6 <= self.Fuel_limit/2:
-                      Allocated.append(j)    # a list that shows uav points and its covering rf stops
-              Allocated.sort(key=lambda x:int(np.sqrt(np.sum(np.square(np.array(x)-np.array(i))))*5280))
-              
-              
-              Allc[(Allocated[0])].append(i) # add that uav points to the nearest rf stop
+        nearest_stop = np.where(nearest < 0, -1, stops[nearest])
+        Allc = {i: Locations_copy[nearest_stop == i].tolist() for i in stops.tolist()}
         
         Allocation = {}
-        for j in range(len(Refuel_stop_Locs)-1):
+        start = self.point_id[starting]
+        for j in range(len(stops)-1):
             
             if j == 0 : 
-                    Allocation[starting, Refuel_stop_Locs[j+1]] = Allc[starting] + Allc[Refuel_stop_Locs[j+1]]
+                    Allocation[starting, Refuel_stop_Locs[j+1]] = [self.points[i] for i in Allc[start] + Allc[stops[j+1]]]
             else : 
-                    Allocation[Refuel_stop_Locs[j], Refuel_stop_Locs[j+1]] = Allc[Refuel_stop_Locs[j+1]]
+                    Allocation[Refuel_stop_Locs[j], Refuel_stop_Locs[j+1]] = [self.points[i] for i in Allc[stops[j+1]]]
+        self.record('allocation', time.time() - allocation_start, mission_points=len(Locations_copy), subproblems=len(Allocation),
+                    unreachable=len(self.unreachable_targets))
         
 
-        cprint('\n Allocation of Mission points obtained = \n {} \n \n'.format( Allocation ), 'cyan', attrs = ['bold'] ) 
+        logger.debug('Allocation of Mission points obtained = %s', Allocation)
         
           
         
         if self.plotting:
             
             ##### plots of the task allocation #####
+            from matplotlib.patches import Circle
+            plt = pyplot(self.plot_dir)
             fig, axes = plt.subplots(1, len(Allocation), figsize=(15, 5), constrained_layout=True)
             
             if len(Allocation) == 1:
@@ -421,7 +859,7 @@ class Major_Replan():
                 fig.suptitle('UGV path and UAV mission points allocation')  # Use suptitle for the figure
 
         
-            plt.show()
+            show_figure(fig, self.plot_dir, 'allocation')
         return Allocation
     
     
@@ -436,7 +874,61 @@ class Major_Replan():
     
     
         
-    def UAV_planner(self, starting_location, Mission_points, UGV_end_stop, UGV_end_stop_time):
+    def greedy_sortie_route(self, time_matrix, fuel_matrix, mission_nodes, refuel_nodes, refuel_ready_time, max_time):
+        
+          '''
+          cheap construction of an initial UAV route for warm starting UAV_planner: from the starting node (0)
+          the UAV repeatedly flies to the nearest mission point from which it can still reach the refuel stop
+          within its fuel and the makespan limit, and refuels when no such point is left.
+
+          Returns
+          -------
+          route : list of nodes (without start and end) ending at a refuel node, or None when the
+              refuel stop cannot be reached within the fuel and makespan limits.
+          '''
+          unvisited = list(mission_nodes)
+          refuels = list(refuel_nodes)
+          refuel_probe = refuels[0]
+          
+          def arrival(t):
+              # the uav may delay its take off so that it does not reach the refuel stop before the ugv #
+              return t if refuelled else max(t, refuel_ready_time)
+          
+          # arcs into refuel nodes carry -Fuel_limit, so the fuel used since the last refuel plus the
+          # fuel of the next hops stays within the limit as long as the sum ending at a refuel node is <= 0 #
+          route = []
+          node, t, fuel, refuelled = 0, 0, 0, False
+          while unvisited and refuels:
+              candidates = [j for j in unvisited
+                            if fuel + fuel_matrix[node, j] + fuel_matrix[j, refuel_probe] <= 0
+                            and arrival(t + time_matrix[node, j] + time_matrix[j, refuel_probe]) <= max_time]
+              if candidates:
+                  j = min(candidates, key=lambda x: time_matrix[node, x])
+                  t += time_matrix[node, j]
+                  fuel += fuel_matrix[node, j]
+                  unvisited.remove(j)
+              elif node in refuel_nodes:
+                  break
+              else:
+                  j = refuels.pop(0)
+                  if fuel + fuel_matrix[node, j] > 0:
+                      return None
+                  t = arrival(t + time_matrix[node, j])
+                  fuel = 0
+                  refuelled = True
+              route.append(j)
+              node = j
+                  
+          if node not in refuel_nodes:
+              if not refuels or fuel + fuel_matrix[node, refuels[0]] > 0:
+                  return None
+              t = arrival(t + time_matrix[node, refuels[0]])
+              route.append(refuels[0])
+          if t > max_time:
+              return None
+          return route
+
+    def UAV_planner(self, starting_location, Mission_points, UGV_end_stop, UGV_end_stop_time, warm_start = False, sorties = 1):
         
     
               '''
@@ -450,6 +942,10 @@ class Major_Replan():
                   ugv path.
               UGV_time : list
                   ugv time.
+              warm_start : bool
+                  start the search from greedy_sortie_route instead of the first solution strategy.
+              sorties : int
+                  number of sortie segments covered by one model; each segment adds its refuel nodes and makespan.
 
               Returns
               -------
@@ -463,8 +959,7 @@ class Major_Replan():
                   """Stores the data for the problem."""
                   
                   data = {}
-                  distance = []
-                  N_d_r =  6   #No_of_duplicate_nodes_for_recharging
+                  N_d_r =  6*sorties   #No_of_duplicate_nodes_for_recharging
                   
                   # as a form of coordinates #
                   A_s = [starting_location]
@@ -491,25 +986,12 @@ class Major_Replan():
                   #creation of distance matrix#
                   A1 = A_s + A_v + A_r + A_e # all coordinates
                   
-                  for i in range(len(A1)):
-                     distance.append([])
-                  for i in range(len(A1)):
-                      for j in range(len(A1)):
-                          a = A1[i]
-                          b = A1[j]
-                          a = np.array(a)
-                          b = np.array(b)
-                          #if i in refuel_stop_nodes and j in refuel_stop_nodes :
-                              #d = 10000
-                          #else: 
-                          d = int(np.sqrt(np.sum(np.square(a-b)))*5280)
-                          distance[i].append(d)
-                  
-                  
-                  
-                  
+                  coordinates = np.array(A1, dtype=float)
+                  delta = coordinates[:, None, :] - coordinates[None, :, :]
+                  distance = (np.sqrt(np.sum(np.square(delta), axis=2))*5280).astype(np.int32)
 
                   data['distance_matrix'] = distance
+                  data['node_ids'] = self.ids(A1)
                   data['num_vehicles'] = 1
                   data['starts'] = starting_node 
                   data['locations']= A1
@@ -531,7 +1013,7 @@ class Major_Replan():
                   
 
                   
-                  print('Time window', data['time_windows'])
+                  logger.debug('Time window %s', data['time_windows'])
                   #print('Starts',data['starts'] , 'Ends', data['ends'])
                   
 
@@ -554,7 +1036,6 @@ class Major_Replan():
 
               def print_solution(data, manager, routing, solution): 
                   
-                      data = create_data_model(print_solution= False)
                       locations = data['locations']
                        
                       
@@ -567,20 +1048,21 @@ class Major_Replan():
                       distance_dimension = routing.GetDimensionOrDie("Distance")
                       fuel_dimension = routing.GetDimensionOrDie("Fuel")
                       time_dimension = routing.GetDimensionOrDie("Time")
+                      # the per node plan is only formatted when it is logged #
+                      detail = logger.isEnabledFor(logging.DEBUG)
+                      
                       # Display dropped nodes.
-                      dropped_nodes = 'Dropped nodes:'
                       dropped_locs = []  
                       for node in range(routing.Size()):
                          if routing.IsStart(node) or routing.IsEnd(node):
                              continue
                          if solution.Value(routing.ActiveVar(node)) == 0:
-                             dropped_nodes += ' {} node {}'.format(manager.IndexToNode(node),locations[manager.IndexToNode(node)])
                              #if locations[manager.IndexToNode(node)] in A_v:
                              if node in data['mission_point_node']:
                                   dropped_locs.append(locations[manager.IndexToNode(node)])
                              
                             
-                      print('Dropped in SP ={}'.format(dropped_locs) )      
+                      logger.info('Dropped in SP = %s', dropped_locs)
                       
                       
                       
@@ -589,12 +1071,14 @@ class Major_Replan():
                       
                       for vehicle_id in range(data['num_vehicles']):
                           
-                          print('UAV id >>>>>>>>>>>>>>> ', vehicle_id)
+                          logger.debug('UAV id >>>>>>>>>>>>>>> %s', vehicle_id)
                           index = routing.Start(vehicle_id)
-                          plan_output = 'Route for vehicle {}:\n'.format(vehicle_id)
+                          plan_output = 'Route for vehicle {}:\n'.format(vehicle_id) if detail else None
                           
                           
-                          ugv_starting_location = starting_location
+                          node_ids = data['node_ids']
+                          end_id = self.point_id[UGV_end_stop]
+                          ugv_starting_location = self.point_id[starting_location]
                          
                           Travelled_node = []
                           Travelled_time_start = []
@@ -620,33 +1104,34 @@ class Major_Replan():
                               Fuel_UAV.append(solution.Value(fuel_var))
                               
 
-                                  
-                              plan_output += "{0} Node {1} Fuel({2}) Time({3},{4}) TimeSlack ({5}) Distance({6}) -> ".format(
-                                  manager.IndexToNode(index),locations[manager.IndexToNode(index)],
-                                  solution.Value(fuel_var),
-                                  solution.Min(time_var), solution.Max(time_var),solution.Value(slack_var), solution.Value(dist_var))
+                              if detail:
+                                  plan_output += "{0} Node {1} Fuel({2}) Time({3},{4}) TimeSlack ({5}) Distance({6}) -> ".format(
+                                      manager.IndexToNode(index),locations[manager.IndexToNode(index)],
+                                      solution.Value(fuel_var),
+                                      solution.Min(time_var), solution.Max(time_var),solution.Value(slack_var), solution.Value(dist_var))
 
                               previous_index = index
                               index = solution.Value(routing.NextVar(index))  
                               
                                
-                              if locations[manager.IndexToNode(index)] == UGV_end_stop:
+                              node = node_ids[manager.IndexToNode(index)]
+                              if node == end_id:
                                   
-                                  if locations[manager.IndexToNode(index)] != locations[manager.IndexToNode(previous_index)] :
+                                  if node != node_ids[manager.IndexToNode(previous_index)] :
                                       
                                   
-                                     self.action_heu.append((self.recharge_map_dict[locations[manager.IndexToNode(index)]], 1))
+                                     self.action_heu.append((int(self.recharge_action[node]), 1))
                               
-                                     UGV_travel_path, UGV_travel_time = self.path_(ugv_starting_location, UGV_end_stop)
+                                     UGV_travel_path = self.path_ids(ugv_starting_location, end_id)
                               
                                      for i in UGV_travel_path :
-                                          self.action_heu.append((self.map_dict[i], 0))
+                                          self.action_heu.append((int(self.visit_action[i]), 0))
                               
-                                     self.action_heu.append((self.recharge_map_dict[i], 0))
+                                     self.action_heu.append((int(self.recharge_action[i]), 0))
                                      ugv_starting_location = UGV_travel_path[-1]
                               
                               else:
-                                     self.action_heu.append((self.map_dict[locations[manager.IndexToNode(index)]], 1))
+                                     self.action_heu.append((int(self.visit_action[node]), 1))
 
                                      
                           
@@ -664,20 +1149,24 @@ class Major_Replan():
      
                           
                               
-                          plan_output += "{0} Node {1} Fuel({2}) Time({3},{4}) TimeSlack ({5}) Distance({6}) -> ".format(
-                              manager.IndexToNode(index),locations[manager.IndexToNode(index)],
-                              solution.Value(fuel_var),
-                              solution.Min(time_var), solution.Max(time_var),solution.Value(slack_var), solution.Value(dist_var))
-                          plan_output += "Distance of the route: {} ft\n".format(solution.Value(dist_var))
-                          plan_output += "Remaining Fuel of the route: {}\n".format(solution.Value(fuel_var))
-                          plan_output += "Total Time of the route: {} seconds\n".format(solution.Value(time_var))
-                          cprint('UAV sortie --->', 'red', attrs = ['bold'])
-                          print(plan_output)
+                          if detail:
+                              plan_output += "{0} Node {1} Fuel({2}) Time({3},{4}) TimeSlack ({5}) Distance({6}) -> ".format(
+                                  manager.IndexToNode(index),locations[manager.IndexToNode(index)],
+                                  solution.Value(fuel_var),
+                                  solution.Min(time_var), solution.Max(time_var),solution.Value(slack_var), solution.Value(dist_var))
+                              plan_output += "Distance of the route: {} ft\n".format(solution.Value(dist_var))
+                              plan_output += "Remaining Fuel of the route: {}\n".format(solution.Value(fuel_var))
+                              plan_output += "Total Time of the route: {} seconds\n".format(solution.Value(time_var))
+                              logger.debug('UAV sortie --->\n%s', plan_output)
                           total_distance += solution.Value(dist_var)
                           total_fuel += solution.Value(fuel_var)
                           total_time += solution.Value(time_var)
 
                           sortie_time = total_time
+                          
+                          self.last_route = {'nodes': Travelled_node, 'arrival_times': Travelled_time_start,
+                                             'latest_times': Travelled_time_end, 'fuel': Fuel_UAV,
+                                             'distance': total_distance, 'sortie_time': sortie_time, 'dropped_locs': dropped_locs}
                       
                           
                           
@@ -703,6 +1192,7 @@ class Major_Replan():
                   
                   # Instantiate the data problem.
 
+                  build_start = time.time()
                   data = create_data_model() 
                   refuel_stations = data['refuel_stations']
                   fuel_limit = data['fuel_limit']
@@ -726,14 +1216,15 @@ class Major_Replan():
                   #------------------------------------------ distance dimension ---------------------------------------------------#
 
                   
-                  def distance_callback(from_index, to_index):
-                      """Returns the distance between the two nodes."""
-                      # Convert from routing variable Index to distance matrix NodeIndex.
-                      from_node = manager.IndexToNode(from_index)
-                      to_node = manager.IndexToNode(to_index)
-                      return data['distance_matrix'][from_node][to_node]
+                  # arc matrices (distance, time, fuel) are precomputed so that the search never calls back into python #
+                  distance_matrix = data['distance_matrix'].astype(np.int64)
+                  flight_time = distance_matrix // data['vehicle_speed']
+                  to_refuel = np.zeros(len(distance_matrix), dtype=np.int64)
+                  to_refuel[refuel_stations] = 1
+                  time_matrix = flight_time + 900*to_refuel[None, :]
+                  fuel_matrix = 198*flight_time - fuel_limit*to_refuel[None, :]
 
-                  transit_callback_index = routing.RegisterTransitCallback(distance_callback)
+                  transit_callback_index = routing.RegisterTransitMatrix(distance_matrix.tolist())
 
                   # Add Distance constraint.
                   dimension_name = 'Distance'
@@ -750,18 +1241,7 @@ class Major_Replan():
                   #-------------------------------------------- time dimension ------------------------------------------------------#
 
                   
-                  def time_callback(from_index, to_index):
-                      from_node = manager.IndexToNode(from_index)
-                      to_node = manager.IndexToNode(to_index)
-                      if to_node in refuel_stations:  # or to_node in end_node:                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                 
-                          refuel_time = 900
-                      else:
-                         refuel_time = 0
-                      t = int(data["distance_matrix"][from_node][to_node] / data["vehicle_speed"]) + refuel_time
-                      return t
-
-
-                  time_callback_index = routing.RegisterTransitCallback(time_callback)
+                  time_callback_index = routing.RegisterTransitMatrix(time_matrix.tolist())
                   routing.SetArcCostEvaluatorOfAllVehicles(time_callback_index)
 
                   
@@ -775,7 +1255,8 @@ class Major_Replan():
                   time_dimension = routing.GetDimensionOrDie('Time')
 
                   
-                  makespan = solver.IntVar(0, 10000, 'makespan')
+                  max_sortie_time = 10000*sorties
+                  makespan = solver.IntVar(0, max_sortie_time, 'makespan')
                   # Constrain makespan to be greater than or equal to each vehicle's end time
                   for vehicle_id in range(data['num_vehicles']):
                         end_index = routing.End(vehicle_id)
@@ -834,20 +1315,7 @@ class Major_Replan():
                   #--------------------------------------------- fuel constraints -----------------------------------------------------#
                  
                   
-                  def fuel_callback(from_index,to_index):
-                      from_node = manager.IndexToNode(from_index)
-                      to_node = manager.IndexToNode(to_index)
-                      
-                      
-                          
-                      if to_node in refuel_stations :
-                          refuel = - fuel_limit
-                      else:
-                          refuel = 0
-                      return ( refuel+ 198*int(data["distance_matrix"][from_node][to_node] / data['vehicle_speed']))
-                  
-
-                  fuel_callback_index = routing.RegisterTransitCallback(fuel_callback)
+                  fuel_callback_index = routing.RegisterTransitMatrix(fuel_matrix.tolist())
                   routing.AddDimension(
                       fuel_callback_index,
                       data['fuel_limit'],
@@ -893,7 +1361,7 @@ class Major_Replan():
 
                   search_parameters = pywrapcp.DefaultRoutingSearchParameters()
                   search_parameters.first_solution_strategy = (
-                      routing_enums_pb2.FirstSolutionStrategy.PATH_MOST_CONSTRAINED_ARC)
+                      getattr(routing_enums_pb2.FirstSolutionStrategy, self.first_solution_strategy))
                   
                   
                   if self.metaheuristics == "TABU_SEARCH":
@@ -905,25 +1373,90 @@ class Major_Replan():
                   search_parameters.local_search_metaheuristic = (meta_heuristics_enum)
                   
                   
-                  search_parameters.time_limit.FromSeconds(self.solver_time)
+                  search_parameters.time_limit.FromMilliseconds(int(1000*self.solver_budget(len(Mission_points))))
+                  if self.solution_limit is not None:
+                      search_parameters.solution_limit = self.solution_limit
+                  
+                  
+                  # stagnation based termination #
+                  if self.stagnation_time is not None or self.stagnation_solutions is not None:
+                      stagnation = {'best': None, 'time': time.time(), 'solutions': 0}
+                      
+                      def stop_on_stagnation():
+                          objective = routing.CostVar().Value()
+                          if stagnation['best'] is None or objective < stagnation['best']:
+                              stagnation['best'] = objective
+                              stagnation['time'] = time.time()
+                              stagnation['solutions'] = 0
+                              return
+                          stagnation['solutions'] += 1
+                          if self.stagnation_solutions is not None and stagnation['solutions'] >= self.stagnation_solutions:
+                              routing.CancelSearch()
+                              
+                      routing.AddAtSolutionCallback(stop_on_stagnation)
+                      
+                      if self.stagnation_time is not None:
+                          
+                          def stagnated():     # checked by the search itself, so it also fires while no new solution comes
+                              return stagnation['best'] is not None and time.time() - stagnation['time'] >= self.stagnation_time
+                              
+                          routing.AddSearchMonitor(solver.CustomLimit(stagnated))
+                  
+                  
+                  # portfolio target: the run that reaches it returns at once and ends the race #
+                  if self.target_objective is not None:
+                      
+                      def stop_at_target():
+                          if routing.CostVar().Value() <= self.target_objective:
+                              routing.CancelSearch()
+                              
+                      routing.AddAtSolutionCallback(stop_at_target)
 
 
                   # Solve the problem.
-                  solution = routing.SolveWithParameters(search_parameters)
+                  initial_assignment = None
+                  if warm_start:
+                      route = self.greedy_sortie_route(time_matrix, fuel_matrix, mission_point_node, refuel_stop_nodes,
+                                                       UGV_end_stop_time, max_sortie_time)
+                      if route is not None:
+                          initial_assignment = routing.ReadAssignmentFromRoutes([[manager.NodeToIndex(node) for node in route]], True)
+                          
+                  search_start = time.time()
+                  self.last_build_time = search_start - build_start
+                  if initial_assignment is not None:
+                      solution = routing.SolveFromAssignmentWithParameters(initial_assignment, search_parameters)
+                  else:
+                      solution = routing.SolveWithParameters(search_parameters)
+                  self.last_search_time = time.time() - search_start
 
                   
 
+                  self.last_status = routing.status()
+                  self.record('uav_planner', self.last_build_time + self.last_search_time,
+                              build_time=self.last_build_time, search_time=self.last_search_time,
+                              mission_points=len(Mission_points), sorties=sorties, nodes=len(data['distance_matrix']),
+                              disjunctions=routing.GetNumberOfDisjunctions(), dimensions=list(routing.GetAllDimensionNames()),
+                              time_limit=self.solver_budget(len(Mission_points)), warm_start=initial_assignment is not None,
+                              status=routing_enums_pb2.RoutingSearchStatus.Value.Name(self.last_status),
+                              objective=solution.ObjectiveValue() if solution else None,
+                              solutions=solver.Solutions(), branches=solver.Branches(), failures=solver.Failures())
+
                   # Print solution on console.
                   if solution:
+                      self.last_objective = solution.ObjectiveValue()
                       dropped_locs = print_solution(data, manager, routing, solution)
                       
                   else:
-                       print('no solution')   
+                       logger.warning('no solution')
+                       raise RuntimeError('No UAV sortie found within the solver time limit of {} s'.format(self.solver_budget(len(Mission_points))))
                   
                     
                   return dropped_locs
               
                 
+              if self.portfolio:
+                  return self.race_UAV_planner(starting_location, Mission_points, UGV_end_stop, UGV_end_stop_time, warm_start, sorties)
+              
               #if __name__ == '__main__':
               sortie_time, dropped_locs = main()
              
@@ -939,27 +1472,72 @@ class Major_Replan():
             
     
 
-#-----------------------    Framework    -------------------------#
+    def race_UAV_planner(self, starting_location, Mission_points, UGV_end_stop, UGV_end_stop_time, warm_start = False, sorties = 1):
+        
+          '''
+          solves the same E-VRPTW subproblem under every metaheuristic / first solution strategy of
+          self.portfolio concurrently, one process each, and keeps the solution with the lowest objective.
+          Each run cancels its search as soon as it reaches self.portfolio_target, and the race then
+          stops the runs still going.
+
+          Returns
+          -------
+          sortie_time, dropped_locs of the winning run, as UAV_planner.
+          '''
+          
+          runs = [(self, entry, self.portfolio_target, starting_location, Mission_points, UGV_end_stop, UGV_end_stop_time, warm_start, sorties)
+                  for entry in self.portfolio]
+          best = None
+          with multiprocessing.Pool(len(runs)) as pool:
+              for result in pool.imap_unordered(portfolio_run, runs):
+                  if result is None:
+                      continue
+                  if best is None or result['objective'] < best['objective']:
+                      best = result
+                  if self.portfolio_target is not None and result['objective'] <= self.portfolio_target:
+                      break
+              pool.terminate()
+          
+          if best is None:
+              raise RuntimeError('No UAV sortie found by any portfolio run within the solver time limit of {} s'.format(self.solver_time))
+          
+          logger.info('Portfolio winner: %s (objective %s)', best['entry'], best['objective'])
+          self.action_heu += best['action_heu']
+          self.last_route = best['route']
+          self.merge_metrics(best['metrics'])
+          self.last_objective = best['objective']
+          self.last_status = best['status']
+          return best['sortie_time'], best['dropped_locs']
+            
+    
 
-def run_scenario_with_metaheuristic(metaheuristic, folder_name, plotting, scale, solver_time):
+def portfolio_run(args):
+    '''
+    one run of the UAV_planner portfolio race, executed in a worker process'''
+    replan, entry, target, starting_location, Mission_points, UGV_end_stop, UGV_end_stop_time, warm_start, sorties = args
+    metaheuristic, _, first_solution_strategy = entry.partition(':')
+    replan.metaheuristics = metaheuristic
+    if first_solution_strategy:
+        replan.first_solution_strategy = first_solution_strategy
+    replan.portfolio = None
+    replan.target_objective = target
+    action_start = len(replan.action_heu)
+    mark = replan.metrics_mark()
+    try:
+        sortie_time, dropped_locs = replan.UAV_planner(starting_location, Mission_points, UGV_end_stop, UGV_end_stop_time, warm_start, sorties)
+    except RuntimeError:
+        return None
+    return {'entry': entry, 'objective': replan.last_objective, 'status': replan.last_status,
+            'sortie_time': sortie_time, 'dropped_locs': dropped_locs,
+            'action_heu': replan.action_heu[action_start:], 'metrics': replan.metrics_since(mark), 'route': replan.last_route}
 
-    
-    
-    
 
-    if not os.path.exists(folder_name):
-       os.makedirs(folder_name) 
 
-    start_time = time.time()
-    
-    cprint('\n <-----------------------Solving one scenario -----------------------------------> \n', 'yellow', attrs = ['bold'])
-    
-    file_path = os.path.join(folder_name, '{}_scenario_data.pkl'.format(scale))
-    with open(file_path , 'rb') as f:
-        data = pickle.load(f)
-    
-    
-    #df = pd.read_csv((os.path.join(folder_name, 'scenario_SS.csv')))
+#-----------------------    Framework    -------------------------#
+
+def build_replan(data, metaheuristic):
+    '''
+    creates the Major_Replan of a scenario from its data (UAV / UGV coordinates and road network)'''
     uav_points_x = data['UAV_X']
     uav_points_y = data['UAV_Y']
 
@@ -976,23 +1554,141 @@ def run_scenario_with_metaheuristic(metaheuristic, folder_name, plotting, scale,
     
 
     replan = Major_Replan(uav_data_points, ugv_data_points, Targets, Locations, starting, metaheuristic)
+    replan.road_network = scenario_csr(data)
+    if 'road_distance' in data or 'coverage_distance' in data:
+        replan.load_artifacts(data)
+    return replan
+
+
+def solve_subproblem(replan, UGV_stops, UAV_points):
+    '''
+    solves the uav sorties of one (UGV_start_stop, UGV_end_stop) subproblem, retrying the dropped points
+    until all are covered, or with one UAV_planner call over max_sorties sortie segments when
+    replan.multi_sortie is set. Runs in a worker process when subproblems are solved in parallel, so the
+    actions it adds to replan.action_heu are also returned to be merged by the caller.
+    '''
+    action_start = len(replan.action_heu)
+    mark = replan.metrics_mark()
+    
+    UGV_start_stop = UGV_stops[0]
+    UGV_end_stop = UGV_stops[1]
+    UGV_end_stop_time = int(replan.cu_dis1(UGV_start_stop, UGV_end_stop)/replan.ugv_speed)
+    
+    Task_points_of_SP = UAV_points
+    starting_location = UGV_stops[0]   # starting location of the UAV 
+    
+    result = {'UGV_stops': UGV_stops, 'sortie_times': [], 'routes': [], 'dropped_locs': [], 'mission_time': 0}
+    
+    dropped_locs =  Task_points_of_SP
+    if dropped_locs == []:
+        logger.info('All points covered by UGV')
+        logger.info('UGV travel time = %s min', round(UGV_end_stop_time/60))
+        result['mission_time'] += UGV_end_stop_time
+        result['action_heu'] = replan.action_heu[action_start:]
+        result['metrics'] = replan.metrics_since(mark)
+        return result
+    
+    if replan.multi_sortie:
+        logger.info('solving uav sorties (single model, up to %s sortie segments) --->', replan.max_sorties)
+        sortie_time, dropped_locs = replan.UAV_planner(starting_location, Task_points_of_SP, UGV_end_stop, UGV_end_stop_time,
+                                                       replan.warm_start_retries, replan.max_sorties)
+        logger.info('UAV sortie time = %s min', round(sortie_time/60))
+        result['sortie_times'].append(sortie_time)
+        result['routes'].append(replan.last_route)
+        result['mission_time'] += sortie_time
+        result['dropped_locs'] = dropped_locs
+        result['action_heu'] = replan.action_heu[action_start:]
+        result['metrics'] = replan.metrics_since(mark)
+        return result
+
+    No_of_times = 0  # in any case if it enters in infinite loop, it will break after 15 iterations
+    while len(dropped_locs) != 0 : 
+        logger.info('solving uav sorties --->')
+        warm_start = replan.warm_start_retries and No_of_times > 0   # retries start from a greedy route of the dropped points
+        sortie_time, dropped_locs = replan.UAV_planner(starting_location, Task_points_of_SP, UGV_end_stop, UGV_end_stop_time, warm_start)
+        logger.info('UAV sortie time = %s min', round(sortie_time/60))
+        result['routes'].append(replan.last_route)
+        Task_points_of_SP = dropped_locs
+        starting_location = UGV_end_stop
+        UGV_end_stop_time = 0
+        No_of_times = No_of_times + 1 
+        result['sortie_times'].append(sortie_time)
+        result['mission_time'] += sortie_time
+        if No_of_times == 15:
+            logger.warning('Infinite loop in solving a subproblem')
+            break
+    
+    result['dropped_locs'] = dropped_locs
+    result['action_heu'] = replan.action_heu[action_start:]
+    result['metrics'] = replan.metrics_since(mark)
+    return result
+
+
+def scenario_path(folder_name, scale):
+    '''
+    <folder_name>/<scale>_scenario_data.npz when it exists, else the pickle of the same name'''
+    file_path = os.path.join(folder_name, '{}_scenario_data.npz'.format(scale))
+    if os.path.exists(file_path):
+        return file_path
+    return os.path.join(folder_name, '{}_scenario_data.pkl'.format(scale))
+
+
+def run_scenario_with_metaheuristic(metaheuristic, folder_name, plotting, scale, solver_time, workers = 1, portfolio = None, portfolio_target = None,
+                                    solver_options = None, scenario_file = None):
+
+    '''
+    solves one scenario, read from <folder_name>/<scale>_scenario_data.npz (or .pkl) or from scenario_file when given.
+
+    Returns
+    -------
+    dict with the total mission time (s), the wall time (s) of each stage, the refuel stops,
+    the per subproblem results and the mission points left dropped.
+    '''
+
+    if not os.path.exists(folder_name):
+       os.makedirs(folder_name) 
+
+    start_time = time.time()
+    stage_times = {}
+    
+    log_banner('<-----------------------Solving one scenario ----------------------------------->', 'yellow')
+    
+    file_path = scenario_file or scenario_path(folder_name, scale)
+    data = load_scenario(file_path)
+    
+    
+    #df = pd.read_csv((os.path.join(folder_name, 'scenario_SS.csv')))
+    replan = build_replan(data, metaheuristic)
+    Targets = replan.Targets
+    Locations = replan.Locations
+    starting  = replan.starting
+    
     replan.solver_time = solver_time
-    replan.road_network_graph = data['UGV_graph']
+    replan.portfolio = portfolio
+    replan.portfolio_target = portfolio_target
+    for key, value in (solver_options or {}).items():   # overrides of Major_Replan defaults, e.g. adaptive_time
+        if not hasattr(replan, key):
+            raise ValueError('Unknown solver option {}'.format(key))
+        setattr(replan, key, value)
+    if replan.road_distance_matrix is None:
+        replan.build_road_distance_oracle()
     replan.plotting = plotting
+    stage_times['load'] = time.time() - start_time
     
     
     if plotting:
 
         ### plotting the scenario ###
+        plt = pyplot(replan.plot_dir)
         fig, ax = plt.subplots() 
         ax.scatter(starting[0],starting[1],s=80,color = 'red',marker = 'o', label='Starting Depot')
         ax.scatter(np.array(Targets)[:, 0], np.array(Targets)[:, 1], s=80, color='black', marker='x', label='Mission Points')
         ax.set_xlim(0,15)
         ax.set_ylim(0,15)
         ax.set_aspect('equal', adjustable='box')
-        plt.title('Scenario')   
-        plt.legend()
-        plt.show()
+        ax.set_title('Scenario')
+        ax.legend()
+        show_figure(fig, replan.plot_dir, 'scenario')
     
 
     mission_points_unvisited  =   replan.Unvisited_Mission_points 
@@ -1002,7 +1698,9 @@ def run_scenario_with_metaheuristic(metaheuristic, folder_name, plotting, scale,
     
     
     '''----- minimum set cover algorithm (MSC) ------'''
+    stage_start = time.time()
     stop_locs_list = replan.CP_set_cover(mission_points_unvisited, road_network, UGV_location)     
+    stage_times['set_cover'] = time.time() - stage_start
     
     
     if len(stop_locs_list) == 1:    # when there is only 1  refuel stop
@@ -1010,90 +1708,96 @@ def run_scenario_with_metaheuristic(metaheuristic, folder_name, plotting, scale,
     
     '''----- Allocation ------'''
 
+    stage_start = time.time()
     Allocation = replan.Allocation_function(mission_points_unvisited, road_network, UGV_location)
+    stage_times['allocation'] = time.time() - stage_start
     
     
     ''' ---- Loop until all points are covered ----'''
     
     
+    stage_start = time.time()
     Total_mission_time = 0
     subproblem = 1
-
-    for key, value in Allocation.items() :
-        print(' ')
-        print('----------------------------------------------------------------------------------------------')
-        print('\n solving subproblem {} >>>>>> \n'.format(subproblem))
-        subproblem += 1
+    results = []
+    pool = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+
+    try:
+        for key, value in Allocation.items() :
+            logger.info('----------------------------------------------------------------------------------------------')
+            logger.info('solving subproblem %s >>>>>>', subproblem)
+            subproblem += 1
         
 
-        UGV_stops =  key
-        UAV_points = value
-        
+            UGV_stops =  key
+            UAV_points = value
         
-        UGV_start_stop = UGV_stops[0]
-        UGV_end_stop = UGV_stops[1]
         
-        UGV_end_stop_time = int(replan.cu_dis1(UGV_start_stop, UGV_end_stop)/replan.ugv_speed)
+            UGV_start_stop = UGV_stops[0]
+            UGV_end_stop = UGV_stops[1]
 
         
-        if plotting:
-
-            ### plotting subproblems ###
-            fig, ax = plt.subplots()
-            ax.scatter(starting[0],starting[1],s=120,color = 'red',marker = 'o', label='Starting Depot')
-            ax.scatter(np.array(Targets)[:, 0], np.array(Targets)[:, 1], s=80, color='black', marker='x', label='Mission Points')
-            ax.set_xlim(0,15)
-            ax.set_ylim(0,15)
-            ax.set_aspect('equal', adjustable='box')
-            ax.scatter(UGV_start_stop[0], UGV_start_stop[1], s=80, color='blue', marker='o', label='UGV Start')
-            ax.scatter(UGV_end_stop[0], UGV_end_stop[1], s=80, color='orange', marker='o', label='UGV End')
-            if len(UAV_points) > 0:
-                ax.scatter(np.array(UAV_points)[:, 0], np.array(UAV_points)[:, 1], s=80, color='r', marker='x', label='UAV Points')
-            ax.set_title('Subproblem {}'.format(subproblem-1))
-            plt.legend()
-            plt.show()
-        
-        
-        
-        Task_points_of_SP = UAV_points
-        starting_location = UGV_stops[0]   # starting location of the UAV 
+            if plotting:
+
+                ### plotting subproblems ###
+                plt = pyplot(replan.plot_dir)
+                fig, ax = plt.subplots()
+                ax.scatter(starting[0],starting[1],s=120,color = 'red',marker = 'o', label='Starting Depot')
+                ax.scatter(np.array(Targets)[:, 0], np.array(Targets)[:, 1], s=80, color='black', marker='x', label='Mission Points')
+                ax.set_xlim(0,15)
+                ax.set_ylim(0,15)
+                ax.set_aspect('equal', adjustable='box')
+                ax.scatter(UGV_start_stop[0], UGV_start_stop[1], s=80, color='blue', marker='o', label='UGV Start')
+                ax.scatter(UGV_end_stop[0], UGV_end_stop[1], s=80, color='orange', marker='o', label='UGV End')
+                if len(UAV_points) > 0:
+                    ax.scatter(np.array(UAV_points)[:, 0], np.array(UAV_points)[:, 1], s=80, color='r', marker='x', label='UAV Points')
+                ax.set_title('Subproblem {}'.format(subproblem-1))
+                ax.legend()
+                show_figure(fig, replan.plot_dir, 'subproblem_{}'.format(subproblem-1))
         
         
         
-            
-        dropped_locs =  Task_points_of_SP
-        if dropped_locs == []:
-            cprint('All points covered by UGV', 'green', attrs = ['bold'])
-            print('UGV travel time = {} min'.format(round(UGV_end_stop_time/60), 2))
-            Total_mission_time += UGV_end_stop_time
-            continue
-
-        No_of_times = 0  # in any case if it enters in infinite loop, it will break after 15 iterations
-        while len(dropped_locs) != 0 : 
-            print('solving uav sorties --->')
-            sortie_time, dropped_locs = replan.UAV_planner(starting_location, Task_points_of_SP, UGV_end_stop, UGV_end_stop_time)
-            print('UAV sortie time = {} min'.format(round(sortie_time/60), 2))
-            Task_points_of_SP = dropped_locs
-            starting_location = UGV_end_stop
-            UGV_end_stop_time = 0
-            No_of_times = No_of_times + 1 
-            Total_mission_time += sortie_time
-            if No_of_times == 15:
-                print('Infinite loop in solving a subproblem')
-                break
+            if pool is None:
+                results.append(solve_subproblem(replan, UGV_stops, UAV_points))
+            else:
+                results.append(pool.submit(solve_subproblem, replan, UGV_stops, UAV_points))
+    
+        if pool is not None:
+            results = [future.result() for future in results]
+    finally:
+        if pool is not None:     # also when a subproblem or a plot raises, so the workers do not outlive the run
+            pool.shutdown(cancel_futures=True)
+    
+    if pool is not None:
+        for result in results:       # merge back in allocation order
+            replan.action_heu += result['action_heu']
+            replan.merge_metrics(result['metrics'])
+    
+    for result in results:
+        Total_mission_time += result['mission_time']
+    stage_times['uav_planning'] = time.time() - stage_start
     
 
-    print('----------------------------------------------------------------------------------------------')
-    print('\n UGV returning to starting depot--->')
+    logger.info('----------------------------------------------------------------------------------------------')
+    logger.info('UGV returning to starting depot--->')
     ugv_return_time = replan.cu_dis1(UGV_end_stop, starting)/replan.ugv_speed
     Total_mission_time += ugv_return_time
-    print('UGV return travel time = {} min'.format(round(ugv_return_time/60), 2))
+    logger.info('UGV return travel time = %s min', round(ugv_return_time/60))
 
     end_time = time.time() 
     total_time = end_time - start_time
+    stage_times['total'] = total_time
 
     
-    cprint('\n Total mission time = {} minutes \n'.format(round(Total_mission_time/60), 2), 'cyan', attrs = ['bold'])
+    log_banner('Total mission time = {} minutes'.format(round(Total_mission_time/60)), 'cyan')
+    
+    return {'total_mission_time': Total_mission_time,
+            'stage_times': stage_times,
+            'stop_locations': replan.stop_locations,
+            'subproblems': results,
+            'dropped_locs': [loc for result in results for loc in result['dropped_locs']],
+            'unreachable_targets': replan.unreachable_targets,
+            'metrics': replan.metrics_summary()}
      
     
           
@@ -1101,8 +1805,12 @@ def run_scenario_with_metaheuristic(metaheuristic, folder_name, plotting, scale,
             
 import argparse
 
-def main_solver(metaheuristics, folder_name, plotting, scale, solver_time):
-     run_scenario_with_metaheuristic(metaheuristics, folder_name, plotting, scale, solver_time)
+def main_solver(metaheuristics, folder_name, plotting, scale, solver_time, workers, portfolio, portfolio_target, solver_options, metrics_file = None):
+     result = run_scenario_with_metaheuristic(metaheuristics, folder_name, plotting, scale, solver_time, workers, portfolio, portfolio_target,
+                                              solver_options)
+     if metrics_file:
+         with open(metrics_file, 'w') as f:
+             json.dump(result['metrics'], f, indent=2, default=str)
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Run scenario solver with metaheuristics")
@@ -1112,22 +1820,100 @@ if __name__ == "__main__":
     
     parser.add_argument("--methods", type=str, default='GUIDED_LOCAL_SEARCH',
                         help="List of metaheuristic methods to run. Example: --methods TABU_SEARCH")
+    parser.add_argument("--portfolio", type=lambda x: x.split(','), default=None,
+                        help="Comma separated metaheuristics (optionally METHOD:FIRST_SOLUTION_STRATEGY) raced on separate cores for every UAV planner call. "
+                             "Example: --portfolio GUIDED_LOCAL_SEARCH,TABU_SEARCH,SIMULATED_ANNEALING:PATH_CHEAPEST_ARC")
+    parser.add_argument("--portfolio_target", type=int, default=None,
+                        help="Stop the portfolio race as soon as one run reaches this objective")
     parser.add_argument("--solver_time", type=int, default=15,
                         help="Solver time for solving E-VRPTW inside UAV planner")
+    parser.add_argument(
+        "--adaptive_time",
+        type=lambda x: (str(x).lower() == 'true'),
+        default=False,
+        help="Scale the solver time of each UAV planner call with its number of mission points (capped by --solver_time)"
+    )
+    parser.add_argument("--time_per_point", type=float, default=0.5,
+                        help="Seconds of search per mission point when --adaptive_time is True")
+    parser.add_argument("--stagnation_time", type=float, default=None,
+                        help="Stop a UAV planner search when its objective has not improved for this many seconds")
+    parser.add_argument("--stagnation_solutions", type=int, default=None,
+                        help="Stop a UAV planner search when its objective has not improved for this many solutions")
+    parser.add_argument(
+        "--multi_sortie",
+        type=lambda x: (str(x).lower() == 'true'),
+        default=False,
+        help="Solve all sorties of a subproblem with one routing model instead of re-solving its dropped points"
+    )
+    parser.add_argument("--max_sorties", type=int, default=3,
+                        help="Number of sortie segments of the single model when --multi_sortie is True")
+    parser.add_argument(
+        "--warm_start",
+        type=lambda x: (str(x).lower() == 'true'),
+        default=True,
+        help="Seed the dropped-point retries of a subproblem with a greedy initial route"
+    )
+    parser.add_argument("--set_cover_engine", type=str, default='cpsat', choices=['cpsat', 'greedy', 'greedy_local'],
+                        help="Refuel stop set cover: exact CP-SAT (hinted, time limited), bitset greedy, or greedy with local improvement")
+    parser.add_argument(
+        "--set_cover_pruning",
+        type=lambda x: (str(x).lower() == 'true'),
+        default=True,
+        help="Remove duplicate and dominated candidate stops and fix the only covers of targets before the set cover"
+    )
+    parser.add_argument("--set_cover_time", type=float, default=10,
+                        help="Time limit (s) of the CP-SAT set cover; the best cover found by then is used")
+    parser.add_argument("--set_cover_workers", type=int, default=None,
+                        help="CP-SAT search workers of the set cover (default: one per core)")
+    parser.add_argument(
+        "--set_cover_hint",
+        type=lambda x: (str(x).lower() == 'true'),
+        default=True,
+        help="Hint the CP-SAT set cover with the greedy_local cover"
+    )
+    parser.add_argument(
+        "--set_cover_log",
+        type=lambda x: (str(x).lower() == 'true'),
+        default=False,
+        help="Log the CP-SAT search progress of the set cover"
+    )
+    parser.add_argument("--tour_engine", type=str, default='auto', choices=['auto', 'ortools'],
+                        help="UGV tour over the refuel stops: Held-Karp up to 15 stops and 2-opt / Or-opt above (auto), or an OR-Tools routing model")
     parser.add_argument("--folder", type=str, default='scenarios',
                         help="Folder name to store/load scenarios")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Number of worker processes solving the subproblems in parallel (1 = sequential)")
+    parser.add_argument("--metrics_file", type=str, default=None,
+                        help="JSON file receiving the per stage wall times, shortest path counters and solver statistics")
+    parser.add_argument("--trace_file", type=str, default=None,
+                        help="JSON lines file receiving every metrics record as soon as it is made")
+    parser.add_argument("--plot_dir", type=str, default=None,
+                        help="Headless plotting: save the scenario, subproblem and allocation figures in this folder instead of showing them (implies --plotting True)")
+    parser.add_argument("--log_level", type=str, default='INFO', choices=['DEBUG', 'INFO', 'WARNING', 'ERROR'],
+                        help="DEBUG also prints the time windows, the per node UAV plans and the allocation; WARNING is quiet")
     
     parser.add_argument(
         "--plotting",
         type=lambda x: (str(x).lower() == 'true'),
-        default=True,
-        help="Set plotting True or False"
+        default=False,
+        help="Show the scenario, subproblem and allocation figures in windows (blocks until they are closed; see --plot_dir)"
     )
     args = parser.parse_args()
-    
+    logging.basicConfig(level=args.log_level, format='%(message)s')
     
 
-    main_solver(metaheuristics=args.methods, folder_name=args.folder, plotting=args.plotting, scale=args.scale, solver_time=args.solver_time)   
+    main_solver(metaheuristics=args.methods, folder_name=args.folder, plotting=args.plotting or args.plot_dir is not None, scale=args.scale, solver_time=args.solver_time, workers=args.workers,
+                portfolio=args.portfolio, portfolio_target=args.portfolio_target,
+                solver_options={'adaptive_time': args.adaptive_time, 'time_per_point': args.time_per_point,
+                                'stagnation_time': args.stagnation_time, 'stagnation_solutions': args.stagnation_solutions,
+                                'warm_start_retries': args.warm_start,
+                                'multi_sortie': args.multi_sortie, 'max_sorties': args.max_sorties,
+                                'set_cover_engine': args.set_cover_engine, 'set_cover_pruning': args.set_cover_pruning,
+                                'set_cover_time': args.set_cover_time,
+                                'set_cover_workers': args.set_cover_workers, 'set_cover_hint': args.set_cover_hint,
+                                'set_cover_log': args.set_cover_log, 'tour_engine': args.tour_engine,
+                                'trace_file': args.trace_file, 'plot_dir': args.plot_dir},
+                metrics_file=args.metrics_file)   
     
     
     